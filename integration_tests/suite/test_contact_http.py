@@ -135,9 +135,13 @@ class TestGoogleContactList(BaseGoogleAssetTestCase):
             has_entries(items=contains(mario)),
         )
 
+    @fixtures.google_source(
+        auth={'host': 'auth-mock', 'port': 9497, 'verify_certificate': False},
+        cache={'ttl': 0},
+    )
     @fixtures.google_result(GOOGLE_CONTACT_LIST)
-    def test_search(self, google_api):
-        self.list_(self.client, self.source_uuid, search='mario'),
+    def test_search(self, google_api, source):
+        self.list_(self.client, source['uuid'], search='mario'),
         google_api.verify(
             {
                 'method': 'GET',
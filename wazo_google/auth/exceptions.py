@@ -0,0 +1,16 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from xivo.rest_api_helpers import APIException
+
+
+class TooManyPendingAuthorizations(APIException):
+
+    code = 503
+
+    def __init__(self, max_pending):
+        message = 'Too many pending Google authorizations.'
+        details = {
+            'max_pending': max_pending,
+        }
+        super().__init__(self.code, message, 'too-many-pending-authorizations', details)
@@ -3,9 +3,6 @@
 
 import logging
 import os
-import time
-from datetime import datetime
-from threading import Thread
 
 from flask import request
 from requests_oauthlib import OAuth2Session
@@ -13,7 +10,6 @@ from wazo_auth import http
 from wazo_auth.exceptions import UserParamException
 from wazo_auth.flask_helpers import Tenant
 
-from .helpers import get_timestamp_expiration
 from .schemas import GoogleSchema
 from .websocket_oauth2 import WebSocketOAuth2
 
@@ -29,18 +25,21 @@ class GoogleAuth(http.AuthResource):
 
     auth_type = 'google'
 
-    def __init__(self, external_auth_service, user_service, config):
+    def __init__(self, external_auth_service, user_service, config, token_service, websocket_manager):
         self.authorization_base_url = config[self.auth_type]['authorization_base_url']
         self.external_auth_service = external_auth_service
         self.redirect_uri = config[self.auth_type]['redirect_uri']
         self.scope = config[self.auth_type]['scope']
         self.token_url = config[self.auth_type]['token_url']
+        self.token_service = token_service
         self.user_service = user_service
+        self.websocket_manager = websocket_manager
         self.websocket_host = config[self.auth_type]['websocket_host']
 
     @http.required_acl('auth.users.{user_uuid}.external.google.create')
     def post(self, user_uuid):
-        client_id, client_secret = self._get_external_config()
+        tenant = Tenant.autodetect()
+        client_id, client_secret = self._get_external_config(tenant)
         self.user_service.get_user(user_uuid)
         self.oauth2 = OAuth2Session(client_id, scope=self.scope, redirect_uri=self.redirect_uri)
         args, errors = GoogleSchema().load(request.get_json())
@@ -66,61 +65,36 @@ class GoogleAuth(http.AuthResource):
             external_auth=self.external_auth_service,
             client_secret=client_secret,
             token_url=self.token_url,
-            auth_type=self.auth_type
+            auth_type=self.auth_type,
+            token_service=self.token_service,
+            tenant_uuid=tenant.uuid,
         )
 
-        # TODO find something better than a thread per request
-        websocket_thread = Thread(
-            target=self.websocket.run,
-            args=(state, user_uuid),
-            name='websocket_thread',
-        )
-        websocket_thread.daemon = True
-        websocket_thread.start()
+        self.websocket_manager.add(self.websocket, state, user_uuid)
 
         return {'authorization_url': authorization_url}, 201
 
     @http.required_acl('auth.users.{user_uuid}.external.google.read')
     def get(self, user_uuid):
         data = self.external_auth_service.get(user_uuid, self.auth_type)
+        tenant = Tenant.autodetect()
 
         expiration = data.get('token_expiration')
 
-        if self._is_token_expired(expiration):
-            return self._refresh_token(user_uuid, data)
+        if self.token_service.is_expired(expiration):
+            data = self.token_service.get_refreshed_token(user_uuid, tenant.uuid, data)
+        else:
+            self.token_service.track(user_uuid, tenant.uuid, expiration)
 
         return self._create_get_response(data)
 
     @http.required_acl('auth.users.{user_uuid}.external.google.delete')
     def delete(self, user_uuid):
         self.external_auth_service.delete(user_uuid, self.auth_type)
+        self.token_service.forget(user_uuid)
         return '', 204
 
-    def _is_token_expired(self, token_expiration):
-        if token_expiration is None:
-            return True
-        return time.mktime(datetime.now().timetuple()) + 30 > token_expiration
-
-    def _refresh_token(self, user_uuid, data):
-        client_id, client_secret = self._get_external_config()
-        oauth2 = OAuth2Session(client_id, token=data)
-        token_data = oauth2.refresh_token(
-            self.token_url,
-            client_id=client_id,
-            client_secret=client_secret,
-        )
-
-        data['refresh_token'] = token_data['refresh_token']
-        data['access_token'] = token_data['access_token']
-        data['token_expiration'] = get_timestamp_expiration(token_data['expires_in'])
-        data['scope'] = token_data['scope']
-
-        self.external_auth_service.update(user_uuid, self.auth_type, data)
-
-        return self._create_get_response(data)
-
-    def _get_external_config(self):
-        tenant = Tenant.autodetect()
+    def _get_external_config(self, tenant):
         config = self.external_auth_service.get_config(self.auth_type, tenant.uuid)
 
         return config.get('client_id'), config.get('client_secret')
@@ -4,6 +4,8 @@
 import logging
 
 from .http import GoogleAuth
+from .services import GoogleTokenService, TokenRefresher
+from .websocket_oauth2 import WebSocketOAuth2Manager
 
 logger = logging.getLogger(__name__)
 
@@ -13,7 +15,22 @@ class GooglePlugin:
     def load(self, dependencies):
         api = dependencies['api']
         config = dependencies['config']
-        args = (dependencies['external_auth_service'], dependencies['user_service'], config)
+        external_auth_service = dependencies['external_auth_service']
+        token_service = GoogleTokenService(external_auth_service, config['google']['token_url'])
+        self.websocket_manager = WebSocketOAuth2Manager(**(config['google'].get('pending_authorizations') or {}))
+        self.websocket_manager.start()
+        args = (
+            external_auth_service,
+            dependencies['user_service'],
+            config,
+            token_service,
+            self.websocket_manager,
+        )
+
+        refresher_config = dict(config['google'].get('token_refresher') or {})
+        if refresher_config.pop('enabled', True):
+            self.token_refresher = TokenRefresher(token_service, **refresher_config)
+            self.token_refresher.start()
 
         api.add_resource(
             GoogleAuth,
@@ -0,0 +1,163 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from requests_oauthlib import OAuth2Session
+
+from .helpers import SingleFlight, get_timestamp_expiration
+
+logger = logging.getLogger(__name__)
+
+
+class GoogleTokenService:
+
+    auth_type = 'google'
+
+    def __init__(self, external_auth_service, token_url):
+        self.external_auth_service = external_auth_service
+        self.token_url = token_url
+        self._refreshes = SingleFlight()
+        self._refreshed_tokens = {}
+        self._linked_users = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_expired(token_expiration, margin=30):
+        if token_expiration is None:
+            return True
+        return time.mktime(datetime.now().timetuple()) + margin > token_expiration
+
+    def track(self, user_uuid, tenant_uuid, token_expiration, used=True):
+        with self._lock:
+            if used:
+                last_used = time.monotonic()
+            else:
+                # The background refreshes must not bring back the users forgotten meanwhile
+                if user_uuid not in self._linked_users:
+                    return
+                _, _, last_used = self._linked_users[user_uuid]
+            self._linked_users[user_uuid] = (tenant_uuid, token_expiration, last_used)
+
+    def forget(self, user_uuid):
+        with self._lock:
+            self._linked_users.pop(user_uuid, None)
+            self._refreshed_tokens.pop(user_uuid, None)
+
+    def expiring_users(self, margin, max_idle=None):
+        with self._lock:
+            if max_idle is not None:
+                self._forget_idle_users(max_idle)
+            linked_users = list(self._linked_users.items())
+
+        return [
+            (user_uuid, tenant_uuid)
+            for user_uuid, (tenant_uuid, token_expiration, _) in linked_users
+            if self.is_expired(token_expiration, margin)
+        ]
+
+    def _forget_idle_users(self, max_idle):
+        now = time.monotonic()
+        idle_users = [
+            user_uuid for user_uuid, (_, _, last_used) in self._linked_users.items()
+            if now - last_used > max_idle
+        ]
+        for user_uuid in idle_users:
+            logger.debug('Google token of user %s unused for %s seconds, no longer refreshed', user_uuid, max_idle)
+            del self._linked_users[user_uuid]
+            self._refreshed_tokens.pop(user_uuid, None)
+
+    def get_refreshed_token(self, user_uuid, tenant_uuid, data):
+        # A caller may have read the token before another one stored its refreshed value
+        refreshed_data = self._refreshed_tokens.get(user_uuid)
+        if refreshed_data and not self.is_expired(refreshed_data.get('token_expiration')):
+            data = refreshed_data
+        else:
+            data = self._refreshes.do(user_uuid, self._refresh_token, user_uuid, tenant_uuid, data)
+
+        self.track(user_uuid, tenant_uuid, data['token_expiration'])
+        return data
+
+    def refresh(self, user_uuid, tenant_uuid):
+        data = self.external_auth_service.get(user_uuid, self.auth_type)
+        if not data or not data.get('refresh_token'):
+            logger.debug('Google account of user %s has no refresh token, no longer refreshed', user_uuid)
+            self.forget(user_uuid)
+            return None
+
+        return self._refreshes.do(user_uuid, self._refresh_token, user_uuid, tenant_uuid, data)
+
+    def _refresh_token(self, user_uuid, tenant_uuid, data):
+        config = self.external_auth_service.get_config(self.auth_type, tenant_uuid)
+        client_id, client_secret = config.get('client_id'), config.get('client_secret')
+
+        oauth2 = OAuth2Session(client_id, token=data)
+        token_data = oauth2.refresh_token(
+            self.token_url,
+            client_id=client_id,
+            client_secret=client_secret,
+        )
+
+        data['refresh_token'] = token_data['refresh_token']
+        data['access_token'] = token_data['access_token']
+        data['token_expiration'] = get_timestamp_expiration(token_data['expires_in'])
+        data['scope'] = token_data['scope']
+
+        self.external_auth_service.update(user_uuid, self.auth_type, data)
+        self._refreshed_tokens[user_uuid] = data
+        self.track(user_uuid, tenant_uuid, data['token_expiration'], used=False)
+
+        return data
+
+
+class TokenRefresher:
+
+    def __init__(self, token_service, interval=60, margin=300, jitter=60, max_workers=4, max_idle=86400):
+        self.token_service = token_service
+        self.interval = interval
+        self.margin = margin
+        self.max_idle = max_idle
+        self.jitter = jitter
+        self.max_workers = max_workers
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='google_token_refresher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while not self._stopped.wait(self.interval):
+                self.refresh_expiring_tokens(executor)
+
+    def refresh_expiring_tokens(self, executor):
+        # The jitter spreads the refreshes of tokens created at the same time
+        margin = self.margin + random.uniform(0, self.jitter)
+        # The tokens of the users who stopped using them are refreshed on their next use instead
+        users = self.token_service.expiring_users(margin, self.max_idle)
+        if not users:
+            return
+
+        logger.debug('Refreshing %s google tokens before their expiration', len(users))
+        for _ in executor.map(self._refresh, users):
+            pass
+
+    def _refresh(self, user):
+        user_uuid, tenant_uuid = user
+        try:
+            self.token_service.refresh(user_uuid, tenant_uuid)
+        except Exception as e:
+            logger.info('Failed to refresh the google token of user %s: %s', user_uuid, e)
+            self.token_service.forget(user_uuid)
@@ -0,0 +1,85 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import threading
+import unittest
+
+from hamcrest import (
+    assert_that,
+    calling,
+    equal_to,
+    raises,
+)
+from mock import Mock, patch, sentinel as s
+
+from .. import helpers
+from ..helpers import SingleFlight
+
+
+class _JoinedEvent(threading.Event):
+
+    def __init__(self, joined):
+        super().__init__()
+        self._joined = joined
+
+    def wait(self, timeout=None):
+        self._joined.wait()
+        return super().wait(timeout)
+
+
+class _Call(helpers._Call):
+
+    def __init__(self, joined):
+        super().__init__()
+        self.done = _JoinedEvent(joined)
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.single_flight = SingleFlight()
+
+    def test_concurrent_calls_are_coalesced(self):
+        nb_followers = 3
+        started, release = threading.Event(), threading.Event()
+        joined = threading.Barrier(nb_followers + 1, timeout=5)
+
+        def refresh():
+            started.set()
+            release.wait()
+            return s.token
+
+        function = Mock(side_effect=refresh)
+        results = []
+        with patch('wazo_google.auth.helpers._Call', lambda: _Call(joined)):
+            leader = threading.Thread(target=lambda: results.append(self.single_flight.do(s.key, function)))
+            leader.start()
+            started.wait()
+            followers = [
+                threading.Thread(target=lambda: results.append(self.single_flight.do(s.key, function)))
+                for _ in range(nb_followers)
+            ]
+            for follower in followers:
+                follower.start()
+            # The followers wait on the barrier when they join the call of the leader
+            joined.wait()
+
+            release.set()
+            for thread in [leader] + followers:
+                thread.join()
+
+        assert_that(results, equal_to([s.token] * 4))
+        assert_that(function.call_count, equal_to(1))
+
+    def test_sequential_calls_are_not_coalesced(self):
+        function = Mock(return_value=s.token)
+
+        self.single_flight.do(s.key, function)
+        self.single_flight.do(s.key, function)
+
+        assert_that(function.call_count, equal_to(2))
+
+    def test_error_is_raised(self):
+        function = Mock(side_effect=RuntimeError)
+
+        assert_that(calling(self.single_flight.do).with_args(s.key, function), raises(RuntimeError))
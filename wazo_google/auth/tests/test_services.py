@@ -0,0 +1,131 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from hamcrest import (
+    assert_that,
+    contains,
+    contains_inanyorder,
+    equal_to,
+    has_entries,
+)
+from mock import Mock, patch, sentinel as s
+
+from ..services import GoogleTokenService, TokenRefresher
+
+
+class TestGoogleTokenService(unittest.TestCase):
+
+    def setUp(self):
+        self.external_auth_service = Mock()
+        self.external_auth_service.get_config.return_value = {
+            'client_id': s.client_id,
+            'client_secret': s.client_secret,
+        }
+        self.service = GoogleTokenService(self.external_auth_service, s.token_url)
+
+    @patch('wazo_google.auth.services.time')
+    def test_expiring_users(self, time):
+        time.mktime.return_value = 1000
+        self.service.track(s.soon, s.tenant_uuid, 1200)
+        self.service.track(s.later, s.tenant_uuid, 2000)
+        self.service.track(s.forgotten, s.tenant_uuid, 1100)
+        self.service.forget(s.forgotten)
+
+        assert_that(self.service.expiring_users(300), contains((s.soon, s.tenant_uuid)))
+
+    @patch('wazo_google.auth.services.OAuth2Session')
+    def test_refresh(self, OAuth2Session):
+        OAuth2Session.return_value.refresh_token.return_value = {
+            'refresh_token': s.refresh_token,
+            'access_token': s.access_token,
+            'expires_in': 3600,
+            'scope': s.scope,
+        }
+        self.external_auth_service.get.return_value = {
+            'access_token': s.old_access_token,
+            'refresh_token': s.old_refresh_token,
+        }
+        self.service.track(s.user_uuid, s.tenant_uuid, 0)
+
+        self.service.refresh(s.user_uuid, s.tenant_uuid)
+
+        self.external_auth_service.get_config.assert_called_once_with('google', s.tenant_uuid)
+        user_uuid, auth_type, data = self.external_auth_service.update.call_args[0]
+        assert_that(data, has_entries(access_token=s.access_token))
+        assert_that(self.service.expiring_users(0), equal_to([]))
+        assert_that(self.service.expiring_users(7200), contains((s.user_uuid, s.tenant_uuid)))
+
+    @patch('wazo_google.auth.services.OAuth2Session')
+    def test_refresh_of_a_forgotten_user_is_not_tracked(self, OAuth2Session):
+        OAuth2Session.return_value.refresh_token.return_value = {
+            'refresh_token': s.refresh_token,
+            'access_token': s.access_token,
+            'expires_in': 3600,
+            'scope': s.scope,
+        }
+        self.external_auth_service.get.return_value = {'refresh_token': s.old_refresh_token}
+
+        self.service.refresh(s.user_uuid, s.tenant_uuid)
+
+        assert_that(self.service.expiring_users(7200), equal_to([]))
+
+    def test_user_without_refresh_token_is_forgotten(self):
+        self.external_auth_service.get.return_value = {'access_token': s.access_token}
+        self.service.track(s.user_uuid, s.tenant_uuid, 0)
+
+        self.service.refresh(s.user_uuid, s.tenant_uuid)
+
+        self.external_auth_service.update.assert_not_called()
+        assert_that(self.service.expiring_users(7200), equal_to([]))
+
+    @patch('wazo_google.auth.services.time.monotonic')
+    def test_idle_users_are_forgotten(self, monotonic):
+        monotonic.return_value = 1000
+        self.service.track(s.idle, s.tenant_uuid, 0)
+        monotonic.return_value = 5000
+        self.service.track(s.active, s.tenant_uuid, 0)
+        self.service.track(s.idle, s.tenant_uuid, 0, used=False)
+
+        monotonic.return_value = 6000
+        assert_that(self.service.expiring_users(300, max_idle=3600), contains((s.active, s.tenant_uuid)))
+        assert_that(self.service.expiring_users(300), contains((s.active, s.tenant_uuid)))
+
+    @patch('wazo_google.auth.services.OAuth2Session')
+    def test_get_refreshed_token_reuses_refreshed_token(self, OAuth2Session):
+        OAuth2Session.return_value.refresh_token.return_value = {
+            'refresh_token': s.refresh_token,
+            'access_token': s.access_token,
+            'expires_in': 3600,
+            'scope': s.scope,
+        }
+
+        self.service.get_refreshed_token(s.user_uuid, s.tenant_uuid, {})
+        result = self.service.get_refreshed_token(s.user_uuid, s.tenant_uuid, {})
+
+        assert_that(result, has_entries(access_token=s.access_token))
+        assert_that(OAuth2Session.return_value.refresh_token.call_count, equal_to(1))
+
+
+class TestTokenRefresher(unittest.TestCase):
+
+    def setUp(self):
+        self.token_service = Mock()
+        self.refresher = TokenRefresher(self.token_service, margin=300, jitter=0)
+
+    def test_refresh_expiring_tokens(self):
+        self.token_service.expiring_users.return_value = [(s.user_1, s.tenant), (s.user_2, s.tenant)]
+        self.token_service.refresh.side_effect = [None, Exception('revoked')]
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            self.refresher.refresh_expiring_tokens(executor)
+
+        self.token_service.expiring_users.assert_called_once_with(300, 86400)
+        assert_that(
+            [call[0] for call in self.token_service.refresh.call_args_list],
+            contains_inanyorder((s.user_1, s.tenant), (s.user_2, s.tenant)),
+        )
+        self.token_service.forget.assert_called_once_with(s.user_2)
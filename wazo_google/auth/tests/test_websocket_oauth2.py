@@ -0,0 +1,132 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import socket
+import threading
+import time
+import unittest
+
+from hamcrest import (
+    assert_that,
+    calling,
+    equal_to,
+    raises,
+)
+from mock import Mock, patch, sentinel as s
+from websocket import ABNF, WebSocket
+
+from ..exceptions import TooManyPendingAuthorizations
+from ..websocket_oauth2 import WebSocketOAuth2Manager
+
+
+class _FakeWebSocket:
+
+    def __init__(self):
+        self._local, self._remote = socket.socketpair()
+        self.sock = self._local
+        self.frames = []
+        self.closed = threading.Event()
+
+    def fileno(self):
+        return self._local.fileno()
+
+    def send_frame(self, opcode, data=b''):
+        self.frames.append((opcode, Mock(data=data)))
+        self._remote.send(b'.')
+
+    def recv_data_frame(self, control_frame=False):
+        self._local.recv(1)
+        return self.frames.pop(0)
+
+    def close(self):
+        self.closed.set()
+        self._local.close()
+        self._remote.close()
+
+
+class TestWebSocketOAuth2Manager(unittest.TestCase):
+
+    def setUp(self):
+        self.websocket_oauth2 = Mock()
+        self.ws = _FakeWebSocket()
+        self.manager = WebSocketOAuth2Manager(max_pending=1, timeout=60)
+        self.manager.start()
+        patcher = patch('wazo_google.auth.websocket_oauth2.websocket.create_connection')
+        self.create_connection = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.manager.stop()
+
+    def add(self, ws, websocket_oauth2=None):
+        self.create_connection.return_value = ws
+        self.manager.add(websocket_oauth2 or self.websocket_oauth2, s.state, s.user_uuid)
+
+    def test_message_is_handled_and_socket_closed(self):
+        self.add(self.ws)
+
+        self.ws.send_frame(ABNF.OPCODE_PING)
+        self.ws.send_frame(ABNF.OPCODE_TEXT, b'{"code": "abc"}')
+
+        assert_that(self.ws.closed.wait(5), equal_to(True))
+        self.manager._executor.shutdown()
+        self.websocket_oauth2.on_message.assert_called_once_with('{"code": "abc"}')
+        assert_that(len(self.manager), equal_to(0))
+
+    def test_closed_by_peer(self):
+        self.add(self.ws)
+
+        self.ws.send_frame(ABNF.OPCODE_CLOSE)
+
+        assert_that(self.ws.closed.wait(5), equal_to(True))
+        self.websocket_oauth2.on_message.assert_not_called()
+
+    def test_abandoned_authorization_is_closed(self):
+        self.manager.timeout = 0.01
+
+        self.add(self.ws)
+
+        assert_that(self.ws.closed.wait(5), equal_to(True))
+        self.websocket_oauth2.on_message.assert_not_called()
+        assert_that(len(self.manager), equal_to(0))
+
+    def test_too_many_pending_authorizations(self):
+        self.add(self.ws)
+        other_ws = _FakeWebSocket()
+
+        assert_that(
+            calling(self.add).with_args(other_ws),
+            raises(TooManyPendingAuthorizations),
+        )
+        other_ws.close()
+
+    def test_failed_connection_releases_its_slot(self):
+        self.create_connection.side_effect = [Exception('unreachable'), self.ws]
+
+        self.manager.add(self.websocket_oauth2, s.state, s.user_uuid)
+        while self.manager._connecting:
+            time.sleep(0.001)
+        self.manager.add(self.websocket_oauth2, s.state, s.user_uuid)
+
+        self.ws.send_frame(ABNF.OPCODE_CLOSE)
+        assert_that(self.ws.closed.wait(5), equal_to(True))
+
+    def test_connection_dropped_by_peer(self):
+        local, remote = socket.socketpair()
+        ws = WebSocket()
+        ws.sock, ws.connected = local, True
+        self.add(ws)
+        _wait_until(lambda: len(self.manager) == 1)
+
+        remote.close()
+
+        _wait_until(lambda: len(self.manager) == 0)
+        assert_that(self.manager._thread.is_alive(), equal_to(True))
+        self.websocket_oauth2.on_message.assert_not_called()
+
+
+def _wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert_that(time.monotonic() < deadline, equal_to(True))
+        time.sleep(0.001)
@@ -3,21 +3,25 @@
 
 import json
 import logging
-from threading import Thread
+import os
+import selectors
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import websocket
 
 from wazo_auth.exceptions import ExternalAuthAlreadyExists
+from .exceptions import TooManyPendingAuthorizations
 from .helpers import get_timestamp_expiration
 
 logger = logging.getLogger(__name__)
 
 
-class WebSocketOAuth2(Thread):
-
-    def __init__(self, host, auth, external_auth, client_secret, token_url, auth_type):
-        super().__init__()
+class WebSocketOAuth2:
 
+    def __init__(self, host, auth, external_auth, client_secret, token_url, auth_type,
+                 token_service=None, tenant_uuid=None):
         self.host = host
         self.oauth2 = auth
         self.external_auth_service = external_auth
@@ -25,36 +29,20 @@ class WebSocketOAuth2(Thread):
         self.token_url = token_url
         self.user_uuid = None
         self.auth_type = auth_type
+        self.token_service = token_service
+        self.tenant_uuid = tenant_uuid
 
-    def run(self, state, user_uuid):
-        self.user_uuid = user_uuid
+    def url(self, state):
+        return '{}/ws/{}'.format(self.host, state)
 
-        ws = websocket.WebSocketApp(
-            '{}/ws/{}'.format(self.host, state),
-            on_message=self._on_message,
-            on_error=self._on_error,
-            on_close=self._on_close)
-        logger.debug('WebSocketOAuth2 opened')
-        try:
-            ws.run_forever()
-        finally:
-            ws.close()
-
-    def _on_message(self, ws, message):
+    def on_message(self, message):
         try:
             logger.debug("Confirmation has been received on websocketOAuth, message : %s", message)
             msg = json.loads(message)
-            ws.close()
             self.create_first_token(self.user_uuid, msg.get('code'))
         except Exception as e:
             logger.error('error when receiving websocket event %s', e)
 
-    def _on_error(self, ws, error):
-        logger.error(error)
-
-    def _on_close(self, ws):
-        logger.debug("WebsocketOAuth closed")
-
     def create_first_token(self, user_uuid, code):
         logger.debug('Trying to fetch token on %s', self.token_url)
         token_data = self.oauth2.fetch_token(
@@ -73,3 +61,162 @@ class WebSocketOAuth2(Thread):
             self.external_auth_service.create(user_uuid, self.auth_type, data)
         except ExternalAuthAlreadyExists:
             self.external_auth_service.update(user_uuid, self.auth_type, data)
+
+        if self.token_service:
+            self.token_service.forget(user_uuid)
+            self.token_service.track(user_uuid, self.tenant_uuid, data['token_expiration'])
+
+
+class _PendingAuthorization:
+
+    def __init__(self, websocket_oauth2, ws, deadline):
+        self.websocket_oauth2 = websocket_oauth2
+        self.ws = ws
+        # The websocket forgets its socket when the peer drops the connection
+        self.fileno = ws.fileno()
+        self.deadline = deadline
+
+
+class WebSocketOAuth2Manager:
+
+    def __init__(self, max_pending=1000, timeout=900, connect_timeout=10, max_workers=4):
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._selector = selectors.DefaultSelector()
+        self._pending = {}
+        self._connecting = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        self._selector.register(self._wakeup_read, selectors.EVENT_READ)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='websocket_oauth2')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup()
+        if self._thread:
+            self._thread.join()
+        self._executor.shutdown()
+        for pending in list(self._pending.values()):
+            self._remove(pending)
+
+    def add(self, websocket_oauth2, state, user_uuid):
+        with self._lock:
+            if len(self._pending) + self._connecting >= self.max_pending:
+                raise TooManyPendingAuthorizations(self.max_pending)
+            self._connecting += 1
+
+        websocket_oauth2.user_uuid = user_uuid
+        # The authorization URL is returned without waiting for the websocket host
+        self._executor.submit(self._connect, websocket_oauth2, state)
+
+    def _connect(self, websocket_oauth2, state):
+        try:
+            ws = websocket.create_connection(websocket_oauth2.url(state), timeout=self.connect_timeout)
+        except Exception as e:
+            logger.error(
+                'Unable to open the websocket of the Google authorization of user %s, error: %s',
+                websocket_oauth2.user_uuid, e,
+            )
+            with self._lock:
+                self._connecting -= 1
+            return
+
+        logger.debug('WebSocketOAuth2 opened')
+        pending = _PendingAuthorization(websocket_oauth2, ws, time.monotonic() + self.timeout)
+
+        with self._lock:
+            self._connecting -= 1
+            # The descriptor of a dropped connection may be reused before it was removed
+            if self._pending.pop(pending.fileno, None) is not None:
+                self._selector.unregister(pending.fileno)
+            self._pending[pending.fileno] = pending
+            self._selector.register(pending.fileno, selectors.EVENT_READ)
+        self._wakeup()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            for key, _ in self._selector.select(timeout=self._next_deadline()):
+                if key.fd == self._wakeup_read:
+                    os.read(self._wakeup_read, 4096)
+                    continue
+
+                pending = self._pending.get(key.fd)
+                if pending:
+                    try:
+                        self._receive(pending)
+                    except Exception:
+                        logger.exception('Unexpected error on the websocket of user %s',
+                                         pending.websocket_oauth2.user_uuid)
+                        self._remove(pending)
+
+            self._remove_expired()
+
+    def _receive(self, pending):
+        while True:
+            try:
+                opcode, frame = pending.ws.recv_data_frame(control_frame=True)
+            except Exception as e:
+                logger.error('WebsocketOAuth error: %s', e)
+                self._remove(pending)
+                return
+
+            if opcode == websocket.ABNF.OPCODE_CLOSE:
+                self._remove(pending)
+                return
+            elif opcode == websocket.ABNF.OPCODE_TEXT:
+                self._remove(pending)
+                self._executor.submit(pending.websocket_oauth2.on_message, frame.data.decode('utf-8'))
+                return
+
+            # Frames already decrypted by SSL are not reported by the selector
+            if not self._has_buffered_data(pending.ws):
+                return
+
+    @staticmethod
+    def _has_buffered_data(ws):
+        pending = getattr(ws.sock, 'pending', None)
+        return bool(pending and pending())
+
+    def _remove_expired(self):
+        now = time.monotonic()
+        for pending in list(self._pending.values()):
+            if pending.deadline <= now:
+                logger.info(
+                    'Google authorization of user %s abandoned after %s seconds',
+                    pending.websocket_oauth2.user_uuid, self.timeout,
+                )
+                self._remove(pending)
+
+    def _remove(self, pending):
+        with self._lock:
+            if self._pending.get(pending.fileno) is not pending:
+                return
+            del self._pending[pending.fileno]
+            self._selector.unregister(pending.fileno)
+
+        try:
+            pending.ws.close()
+        except Exception as e:
+            logger.debug('Error while closing the WebsocketOAuth: %s', e)
+        logger.debug('WebsocketOAuth closed')
+
+    def _next_deadline(self):
+        with self._lock:
+            if not self._pending:
+                return None
+            deadline = min(pending.deadline for pending in self._pending.values())
+        return max(deadline - time.monotonic(), 0)
+
+    def _wakeup(self):
+        os.write(self._wakeup_write, b'.')
@@ -0,0 +1,101 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import asyncio
+import logging
+import ssl
+import threading
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(pool_size):
+    if aiohttp is None:
+        logger.error('aiohttp is not installed, the asyncio engine cannot be used')
+        return None
+
+    with _engines_lock:
+        engine = _engines.get(pool_size)
+        if engine is None:
+            engine = _engines[pool_size] = AsyncEngine(pool_size)
+        return engine
+
+
+class AsyncEngine:
+
+    def __init__(self, pool_size):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever,
+            name='google_async_engine',
+        )
+        self._thread.daemon = True
+        self._thread.start()
+        self._session = self.run(self._create_session(pool_size))
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def stop(self):
+        self.run(self._session.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def get_json(self, url, headers=None, params=None, timeout=None, verify=True):
+        try:
+            async with self._session.get(
+                url,
+                headers=headers,
+                params=self._encode_params(params),
+                timeout=aiohttp.ClientTimeout(total=timeout),
+                ssl=self._ssl(verify),
+            ) as response:
+                if response.status != 200:
+                    return response.status, None
+                return response.status, await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error('Unable to reach %s, error: %s', url, e)
+            return None, None
+
+    async def gather_json(self, urls, **kwargs):
+        return await asyncio.gather(*(self.get_json(url, **kwargs) for url in urls))
+
+    async def get_external_auth(self, user_uuid, wazo_token, host='localhost', port=9497,
+                                version='0.1', verify_certificate=True, timeout=None,
+                                https=True, prefix=None, **ignored):
+        url = '{scheme}://{host}:{port}{prefix}/{version}/users/{user_uuid}/external/google'.format(
+            scheme='https' if https else 'http',
+            host=host,
+            port=port,
+            prefix=prefix or '',
+            version=version,
+            user_uuid=user_uuid,
+        )
+        headers = {'X-Auth-Token': wazo_token, 'Accept': 'application/json'}
+        return await self.get_json(url, headers=headers, timeout=timeout, verify=verify_certificate)
+
+    @staticmethod
+    async def _create_session(pool_size):
+        return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=pool_size))
+
+    @staticmethod
+    def _encode_params(params):
+        if not params:
+            return None
+        return {key: str(value) for key, value in params.items()}
+
+    @staticmethod
+    def _ssl(verify):
+        if verify is False:
+            return False
+        if isinstance(verify, str):
+            return ssl.create_default_context(cafile=verify)
+        return None
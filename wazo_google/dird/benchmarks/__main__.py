@@ -0,0 +1,209 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import argparse
+import datetime
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+from collections import OrderedDict
+
+from .. import services
+from ..plugin import GooglePlugin
+from .feed import FeedGenerator
+
+DEFAULT_SIZES = (100, 1000, 10000, 50000)
+DEFAULT_REPEAT = 5
+SEARCH_TERM = 'bros'
+PAGE_SIZE = 20
+
+operations = OrderedDict()
+
+
+def operation(name):
+    def decorator(setup):
+        operations[name] = setup
+        return setup
+    return decorator
+
+
+def _load_plugin(contacts, book=None):
+    plugin = GooglePlugin()
+    plugin.load({
+        'config': {
+            'auth': {'host': 'localhost'},
+            'name': 'google',
+            'searched_columns': list(services.GoogleService.searched_columns),
+            'first_matched_columns': ['numbers', 'normalized_numbers'],
+            'format_columns': {'reverse': '{name}'},
+        },
+    })
+    plugin._get_google_token = lambda **ignored: 'google-token'
+    plugin.google.get_contact_book = lambda *args, **kwargs: book
+    plugin.google._fetch = lambda google_token, term=None: iter(contacts)
+    return plugin
+
+
+def _last_number(contacts):
+    for contact in reversed(contacts):
+        if contact['numbers']:
+            return contact['numbers'][0]
+
+
+@operation('format')
+def _format(entries, contacts):
+    formatter = services.ContactFormatter()
+    return lambda: [formatter.format(entry) for entry in entries]
+
+
+@operation('search_match_predicate')
+def _search_match_predicate(entries, contacts):
+    plugin = _load_plugin(contacts)
+    return lambda: [contact for contact in contacts if plugin._search_match_predicate(contact, SEARCH_TERM)]
+
+
+@operation('first_match_stream')
+def _first_match_stream(entries, contacts):
+    plugin = _load_plugin(contacts)
+    term = _last_number(contacts)
+    return lambda: plugin.first_match(term, {'xivo_user_uuid': 'user-uuid', 'token': 'wazo-token'})
+
+
+@operation('first_match_book')
+def _first_match_book(entries, contacts):
+    plugin = _load_plugin(contacts, services.ContactBook(contacts))
+    term = _last_number(contacts)
+    args = {'xivo_user_uuid': 'user-uuid', 'token': 'wazo-token'}
+    # The index is built by the first lookup and kept with the book
+    plugin.first_match(term, args)
+    return lambda: plugin.first_match(term, args)
+
+
+@operation('sort')
+def _sort(entries, contacts):
+    google = services.GoogleService()
+    return lambda: google._sort(contacts, order='name')
+
+
+@operation('sort_page')
+def _sort_page(entries, contacts):
+    google = services.GoogleService()
+    return lambda: google._sort(contacts, order='name', limit=PAGE_SIZE, offset=PAGE_SIZE)
+
+
+@operation('paginate')
+def _paginate(entries, contacts):
+    google = services.GoogleService()
+    return lambda: google._paginate(contacts, limit=PAGE_SIZE, offset=len(contacts) // 2)
+
+
+def measure(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    # Allocations are traced on a separate run, tracing slows down the function
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = function()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+
+    return {
+        'min_ms': min(timings) * 1000,
+        'median_ms': statistics.median(timings) * 1000,
+        'mean_ms': statistics.mean(timings) * 1000,
+        'peak_bytes': peak,
+        'retained_bytes': current,
+    }
+
+
+def run(sizes=DEFAULT_SIZES, repeat=DEFAULT_REPEAT, names=None, seed=0):
+    generator = FeedGenerator(seed)
+    formatter = services.ContactFormatter()
+    results = []
+    for size in sizes:
+        entries = generator.entries(size)
+        contacts = [formatter.format(entry) for entry in entries]
+        for name, setup in operations.items():
+            if names and name not in names:
+                continue
+
+            result = OrderedDict([('operation', name), ('contacts', size)])
+            result.update(measure(setup(entries, contacts), repeat))
+            results.append(result)
+
+    return {
+        'python': platform.python_version(),
+        'created_at': datetime.datetime.utcnow().isoformat(),
+        'seed': seed,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(report, baseline):
+    previous = {
+        (result['operation'], result['contacts']): result
+        for result in baseline['results']
+    }
+    for result in report['results']:
+        reference = previous.get((result['operation'], result['contacts']))
+        if reference:
+            result['median_ratio'] = result['median_ms'] / reference['median_ms']
+            result['peak_ratio'] = result['peak_bytes'] / max(reference['peak_bytes'], 1)
+
+
+def print_report(report, output=sys.stdout):
+    header = '{:<24} {:>8} {:>12} {:>12} {:>14} {:>8}'
+    row = '{:<24} {:>8} {:>12.3f} {:>12.3f} {:>14} {:>8}'
+    print(header.format('operation', 'contacts', 'min (ms)', 'median (ms)', 'peak (bytes)', 'ratio'), file=output)
+    for result in report['results']:
+        ratio = result.get('median_ratio')
+        print(row.format(
+            result['operation'],
+            result['contacts'],
+            result['min_ms'],
+            result['median_ms'],
+            result['peak_bytes'],
+            '{:.2f}'.format(ratio) if ratio is not None else '-',
+        ), file=output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths of the dird Google backend')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='the number of contacts of the generated books')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='the number of timed runs of each operation')
+    parser.add_argument('--operation', action='append', choices=list(operations),
+                        help='the operations to run, all of them by default')
+    parser.add_argument('--seed', type=int, default=0, help='the seed of the generated feed')
+    parser.add_argument('--output', help='the file where the results are saved as JSON')
+    parser.add_argument('--compare', help='the JSON results of a previous run')
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.repeat, args.operation, args.seed)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
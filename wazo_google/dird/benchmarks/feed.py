@@ -0,0 +1,104 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import random
+
+FIRST_NAMES = (
+    'Alice', 'Amélie', 'Bob', 'Chloé', 'David', 'Élodie', 'François', 'Hélène', 'Jean',
+    'Jérôme', 'Louis', 'Luigi', 'Mario', 'Nathalie', 'Peach', 'Sébastien', 'Thomas', 'Zoé',
+)
+LAST_NAMES = (
+    'Bernard', 'Bros', 'Dubois', 'Durand', 'Lefèvre', 'Martin', 'Moreau', 'Petit', 'Robert',
+    'Roux', 'Smith', 'Thomas', 'Toad', 'Tremblay',
+)
+DOMAINS = ('example.com', 'gmail.com', 'wazo.io', 'yahoo.fr')
+
+# Weights observed in real address books: most contacts have a single mobile number
+NUMBER_COUNTS = ((0, 10), (1, 55), (2, 25), (3, 10))
+NUMBER_LABELS = (('mobile', 50), ('home', 20), ('work', 20), (None, 10))
+CUSTOM_LABELS = ('office', 'fax', 'parents', 'cottage')
+EMAIL_COUNTS = ((0, 30), (1, 55), (2, 15))
+REL_URL = 'http://schemas.google.com/g/2005#{}'
+ID_URL = 'http://www.google.com/m8/feeds/contacts/bench%40example.com/base/{:016x}'
+
+
+class FeedGenerator:
+
+    def __init__(self, seed=0):
+        self.seed = seed
+
+    def entries(self, count):
+        rand = random.Random('{}-{}'.format(self.seed, count))
+        return [self._entry(rand, index) for index in range(count)]
+
+    def feed(self, count, page_size=None):
+        entries = self.entries(count)
+        feed = {
+            'openSearch$totalResults': {'$t': str(count)},
+            'updated': {'$t': '2019-07-01T12:00:00.000Z'},
+            'link': [],
+            'entry': entries[:page_size],
+        }
+        if page_size is not None and page_size < count:
+            feed['link'].append({'rel': 'next', 'href': 'next'})
+        return {'feed': feed}
+
+    def _entry(self, rand, index):
+        first_name, last_name = rand.choice(FIRST_NAMES), rand.choice(LAST_NAMES)
+        entry = {
+            'id': {'$t': ID_URL.format(index)},
+            'updated': {'$t': '2019-06-{:02d}T10:00:00.000Z'.format(1 + index % 28)},
+            'title': {'$t': '{} {}'.format(first_name, last_name), 'type': 'text'},
+        }
+
+        numbers = [self._number(rand) for _ in range(self._weighted(rand, NUMBER_COUNTS))]
+        if numbers:
+            entry['gd$phoneNumber'] = numbers
+
+        emails = [
+            self._email(rand, first_name, last_name, position)
+            for position in range(self._weighted(rand, EMAIL_COUNTS))
+        ]
+        if emails:
+            entry['gd$email'] = emails
+
+        return entry
+
+    def _number(self, rand):
+        label = self._weighted(rand, NUMBER_LABELS)
+        digits = ''.join(str(rand.randint(0, 9)) for _ in range(8))
+        style = rand.random()
+        if style < 0.4:
+            value = '+33 6 {} {} {} {}'.format(digits[:2], digits[2:4], digits[4:6], digits[6:])
+        elif style < 0.7:
+            value = '06.{}.{}.{}.{}'.format(digits[:2], digits[2:4], digits[4:6], digits[6:])
+        else:
+            value = '(555) {}-{}'.format(digits[:3], digits[3:7])
+
+        number = {'$t': value}
+        if label:
+            number['rel'] = REL_URL.format(label)
+        else:
+            number['label'] = rand.choice(CUSTOM_LABELS)
+        return number
+
+    @staticmethod
+    def _email(rand, first_name, last_name, position):
+        email = {
+            'address': '{}.{}{}@{}'.format(
+                first_name.lower(), last_name.lower(), position or '', rand.choice(DOMAINS),
+            ),
+            'rel': REL_URL.format('home' if position else 'work'),
+        }
+        if not position:
+            email['primary'] = 'true'
+        return email
+
+    @staticmethod
+    def _weighted(rand, choices):
+        position = rand.uniform(0, sum(weight for _, weight in choices))
+        for value, weight in choices:
+            position -= weight
+            if position < 0:
+                return value
+        return value
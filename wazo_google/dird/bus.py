@@ -0,0 +1,85 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+import logging
+import threading
+
+from contextlib import contextmanager
+
+import kombu
+
+from kombu.mixins import ConsumerMixin
+
+logger = logging.getLogger(__name__)
+
+STOP_TIMEOUT = 5
+
+
+class _Stopped(Exception):
+    pass
+
+
+class BusConsumer(ConsumerMixin):
+
+    def __init__(self, username='guest', password='guest', host='localhost', port=5672,
+                 exchange_name='xivo', exchange_type='topic', **ignored):
+        self._url = 'amqp://{}:{}@{}:{}//'.format(username, password, host, port)
+        self._exchange = kombu.Exchange(exchange_name, type=exchange_type)
+        self._routing_keys = []
+        self._callbacks = {}
+        self._thread = None
+        self.connection = None
+
+    def subscribe(self, event_name, routing_key, callback):
+        self._callbacks.setdefault(event_name, []).append(callback)
+        if routing_key not in self._routing_keys:
+            self._routing_keys.append(routing_key)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='google_bus_consumer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.should_stop = True
+        if self._thread:
+            self._thread.join(STOP_TIMEOUT)
+            if self._thread.is_alive():
+                logger.warning('Google bus consumer still running %s seconds after its stop', STOP_TIMEOUT)
+
+    def _run(self):
+        with kombu.Connection(self._url) as connection:
+            self.connection = connection
+            try:
+                self.run()
+            except _Stopped:
+                logger.debug('Google bus consumer stopped while connecting')
+
+    @contextmanager
+    def establish_connection(self):
+        # The connection is retried forever, the stop is checked while waiting between the attempts
+        with self.create_connection() as conn:
+            conn.ensure_connection(self.on_connection_error, self.connect_max_retries, callback=self._check_stopped)
+            yield conn
+
+    def _check_stopped(self):
+        if self.should_stop:
+            raise _Stopped()
+
+    def get_consumers(self, Consumer, channel):
+        queue = kombu.Queue(
+            exclusive=True,
+            bindings=[kombu.binding(self._exchange, routing_key=key) for key in self._routing_keys],
+        )
+        return [Consumer(queues=[queue], callbacks=[self._on_message])]
+
+    def _on_message(self, body, message):
+        try:
+            event = json.loads(body) if isinstance(body, (str, bytes)) else body
+            for callback in self._callbacks.get(event.get('name'), []):
+                callback(event.get('data') or {})
+        except Exception:
+            logger.exception('Failed to handle the bus message %s', body)
+        finally:
+            message.ack()
@@ -3,12 +3,13 @@
 
 import logging
 
-from flask import request
+from flask import Response, request
 from wazo_dird.auth import required_acl
 from wazo_dird.helpers import SourceItem, SourceList
 from wazo_dird.rest_api import AuthResource
 from xivo.tenant_flask_helpers import Tenant, token
 
+from . import metrics
 from .schemas import (
     contact_list_schema,
     list_schema,
@@ -28,9 +29,9 @@ class GoogleContactList(AuthResource):
         self.auth_config = auth_config
         self.config = config
         self.source_service = source_service
-        self.google = GoogleService()
 
     @required_acl('dird.backends.google.sources.{source_uuid}.contacts.read')
+    @metrics.instrumented('list_contacts', count=lambda result: len(result[0]['items']))
     def get(self, source_uuid):
         user_uuid = token.user_uuid
         token_from_request = request.headers.get('X-Auth-Token')
@@ -38,17 +39,44 @@ class GoogleContactList(AuthResource):
         list_params, errors = contact_list_schema.load(request.args)
 
         source = self.source_service.get(self.BACKEND, source_uuid, [tenant.uuid])
-        google_token = get_google_access_token(user_uuid, token_from_request, **source['auth'])
-
-        contacts, total = self.google.get_contacts(google_token, **list_params)
+        google = GoogleService(source)
+        google_token = get_google_access_token(
+            user_uuid,
+            token_from_request,
+            pool_size=google.pool_size,
+            engine=google.engine,
+            missing_token_ttl=google.missing_token_ttl,
+            **source['auth']
+        )
+
+        contacts, total = google.get_contacts(google_token, user_uuid, **list_params)
 
         return {
             'filtered': total,
-            'items': contacts,
+            'items': [dict(contact) for contact in contacts],
             'total': total,
         }, 200
 
 
+class GoogleMetrics(AuthResource):
+
+    @required_acl('dird.backends.google.metrics.read')
+    def get(self):
+        return Response(metrics.registry.render(), content_type='text/plain; version=0.0.4')
+
+
+class GoogleWarmup(AuthResource):
+
+    def __init__(self, prewarmer):
+        self.prewarmer = prewarmer
+
+    @required_acl('dird.backends.google.warmup.create')
+    def post(self):
+        tenant = Tenant.autodetect()
+        self.prewarmer.warm_tenant(tenant.uuid)
+        return {'tenant_uuid': tenant.uuid}, 202
+
+
 class GoogleList(SourceList):
 
     list_schema = list_schema
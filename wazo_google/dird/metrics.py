@@ -0,0 +1,202 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import threading
+import time
+
+from contextlib import contextmanager
+from functools import wraps
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+
+class _Metric:
+
+    type_ = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _format_labels(self, key, **extra):
+        pairs = list(zip(self.labels, key)) + sorted(extra.items())
+        if not pairs:
+            return ''
+        return '{{{}}}'.format(','.join('{}="{}"'.format(name, value) for name, value in pairs))
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+
+    type_ = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, self._format_labels(key), value
+
+
+class Histogram(_Metric):
+
+    type_ = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0, 0)
+            for position, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    counts[position] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def count(self, **labels):
+        _, _, count = self._values.get(self._key(labels)) or (None, 0, 0)
+        return count
+
+    def sum(self, **labels):
+        _, total, _ = self._values.get(self._key(labels)) or (None, 0, 0)
+        return total
+
+    def samples(self):
+        with self._lock:
+            values = sorted(
+                (key, (list(counts), total, count))
+                for key, (counts, total, count) in self._values.items()
+            )
+        for key, (counts, total, count) in values:
+            for bucket, bucket_count in zip(self.buckets, counts):
+                yield self.name + '_bucket', self._format_labels(key, le=bucket), bucket_count
+            yield self.name + '_bucket', self._format_labels(key, le='+Inf'), count
+            yield self.name + '_sum', self._format_labels(key), total
+            yield self.name + '_count', self._format_labels(key), count
+
+
+class Registry:
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._metrics = []
+
+    def counter(self, name, description, labels=()):
+        return self._register(Counter(self.prefix + name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self.prefix + name, description, labels, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def reset(self):
+        for metric in self._metrics:
+            metric.reset()
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.description))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type_))
+            for name, labels, value in metric.samples():
+                lines.append('{}{} {}'.format(name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry('wazo_dird_google_')
+
+google_request_duration = registry.histogram(
+    'request_duration_seconds',
+    'Duration of the requests sent to Google until the response headers are received',
+    labels=('endpoint',),
+)
+google_responses = registry.counter(
+    'responses_total',
+    'Responses received from Google by status code',
+    labels=('endpoint', 'status'),
+)
+google_received_bytes = registry.counter(
+    'received_bytes_total',
+    'Size of the bodies received from Google',
+    labels=('endpoint',),
+)
+google_received_contacts = registry.counter(
+    'received_contacts_total',
+    'Contacts received from Google',
+)
+auth_request_duration = registry.histogram(
+    'auth_request_duration_seconds',
+    'Duration of the requests sent to wazo-auth to get the Google tokens',
+)
+auth_responses = registry.counter(
+    'auth_responses_total',
+    'Responses received from wazo-auth by status code',
+    labels=('status',),
+)
+cache_requests = registry.counter(
+    'cache_requests_total',
+    'Lookups in the caches of the Google backend',
+    labels=('cache', 'result'),
+)
+cache_refreshes = registry.counter(
+    'cache_refreshes_total',
+    'Background refreshes of the expired contacts by outcome',
+    labels=('result',),
+)
+prewarms = registry.counter(
+    'prewarms_total',
+    'Contact books of users loaded in advance by outcome',
+    labels=('result',),
+)
+operation_duration = registry.histogram(
+    'operation_duration_seconds',
+    'Duration of the operations of the Google backend',
+    labels=('operation',),
+)
+operation_results = registry.histogram(
+    'operation_results',
+    'Number of contacts returned by the operations of the Google backend',
+    labels=('operation',),
+    buckets=SIZE_BUCKETS,
+)
+
+
+def instrumented(operation, count=len):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with operation_duration.time(operation=operation):
+                result = function(*args, **kwargs)
+            operation_results.observe(count(result), operation=operation)
+            return result
+        return wrapper
+    return decorator
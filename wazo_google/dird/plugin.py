@@ -2,22 +2,38 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import logging
+import re
+
+from string import Formatter
 
 from wazo_dird import BaseSourcePlugin, make_result_class
 
 from .exceptions import GoogleTokenNotFoundException
-from . import services
+from . import metrics, services
 
 logger = logging.getLogger(__name__)
 
 
+def used_columns(config, unique_column='id'):
+    format_columns = dict(config.get(GooglePlugin.FORMAT_COLUMNS) or {})
+    format_columns.setdefault('reverse', '{name}')
+
+    columns = {unique_column}
+    columns.update(config.get(GooglePlugin.SEARCHED_COLUMNS) or [])
+    columns.update(config.get(GooglePlugin.FIRST_MATCHED_COLUMNS) or [])
+    for format_string in format_columns.values():
+        for _, field_name, _, _ in Formatter().parse(format_string):
+            if field_name:
+                columns.add(re.split(r'[.\[]', field_name, 1)[0])
+    return columns
+
+
 class GooglePlugin(BaseSourcePlugin):
 
     def load(self, dependencies):
         config = dependencies['config']
         self.auth = config['auth']
         self.name = config['name']
-        self.google = services.GoogleService()
         self.unique_column = 'id'
 
         format_columns = dependencies['config'].get(self.FORMAT_COLUMNS, {})
@@ -49,6 +65,10 @@ class GooglePlugin(BaseSourcePlugin):
                 self.name,
             )
 
+        columns = used_columns(config, self.unique_column)
+        self.google = services.GoogleService(config, columns)
+
+    @metrics.instrumented('search')
     def search(self, term, args=None):
         logger.debug('Searching term=%s', term)
         try:
@@ -56,23 +76,28 @@ class GooglePlugin(BaseSourcePlugin):
         except GoogleTokenNotFoundException:
             return []
 
+        book = self.google.get_contact_book(google_token, args.get('xivo_user_uuid'))
+        if book is not None:
+            return [self._SourceResult(c) for c in book.search(self._searched_columns, term)]
+
         contacts = self.google.get_contacts_with_term(google_token, term)
-        lowered_term = term.lower()
-        filtered_contacts = [c for c in contacts if self._search_match_predicate(c, lowered_term)]
+        # Accents are ignored like in the searches of the cached contacts
+        folded_term = services.fold(term.lower())
 
-        return [self._SourceResult(c) for c in filtered_contacts]
+        return [self._SourceResult(c) for c in contacts if self._search_match_predicate(c, folded_term)]
 
+    @metrics.instrumented('list')
     def list(self, unique_ids, args=None):
         try:
             google_token = self._get_google_token(**args)
         except GoogleTokenNotFoundException:
             return []
 
-        contacts, _ = self.google.get_contacts(google_token)
-        filtered_contacts = [c for c in contacts if c[self.unique_column] in unique_ids]
+        contacts = self.google.get_contacts_by_ids(google_token, unique_ids, args.get('xivo_user_uuid'))
 
-        return [self._SourceResult(contact) for contact in filtered_contacts]
+        return [self._SourceResult(contact) for contact in contacts]
 
+    @metrics.instrumented('first_match', count=lambda result: 0 if result is None else 1)
     def first_match(self, term, args=None):
         if not self._first_matched_columns:
             logger.debug(
@@ -87,13 +112,30 @@ class GooglePlugin(BaseSourcePlugin):
             logger.debug('could not find a matching google token, aborting first_match')
             return None
 
-        contacts, _ = self.google.get_contacts(google_token)
-        lowered_term = term.lower()
+        user_uuid = args.get('xivo_user_uuid')
+        terms = self._first_match_terms(term)
+
+        book = self.google.get_contact_book(google_token, user_uuid)
+        if book is not None:
+            for lowered_term in terms:
+                contact = book.first_match(self._first_matched_columns, lowered_term)
+                if contact:
+                    return self._SourceResult(contact)
+            return None
 
+        # The contacts are streamed to avoid fetching the pages following the first match
+        contacts = self.google.get_contacts_with_term(google_token, None)
         for contact in contacts:
-            if self._first_match_predicate(lowered_term, contact):
+            if any(self._first_match_predicate(lowered_term, contact) for lowered_term in terms):
                 return self._SourceResult(contact)
 
+    def _first_match_terms(self, term):
+        lowered_term = term.lower()
+        canonical_number = self.google.normalizer.canonical(lowered_term)
+        if canonical_number == lowered_term:
+            return [lowered_term]
+        return [lowered_term, canonical_number]
+
     def _first_match_predicate(self, term, contact):
         for column in self._first_matched_columns:
             column_value = contact.get(column) or ''
@@ -111,16 +153,23 @@ class GooglePlugin(BaseSourcePlugin):
             logger.debug('Unable to search through Google without a token.')
             raise GoogleTokenNotFoundException()
 
-        return services.get_google_access_token(xivo_user_uuid, token, **self.auth)
+        return services.get_google_access_token(
+            xivo_user_uuid,
+            token,
+            pool_size=self.google.pool_size,
+            engine=self.google.engine,
+            missing_token_ttl=self.google.missing_token_ttl,
+            **self.auth
+        )
 
     def _search_match_predicate(self, contact, term):
         for field in self._searched_columns:
             column_value = contact.get(field) or ''
             if not isinstance(column_value, (dict, list)):
-                if term in column_value.lower():
+                if term in services.fold(column_value.lower()):
                     return True
             else:
                 for value in column_value:
-                    if term in value.lower():
+                    if term in services.fold(value.lower()):
                         return True
         return False
@@ -0,0 +1,129 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from wazo_auth_client import Client as Auth
+
+from . import metrics, services
+from .exceptions import GoogleTokenNotFoundException
+from .plugin import used_columns
+
+logger = logging.getLogger(__name__)
+
+BACKEND = 'google'
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_TOKEN_EXPIRATION = 3600
+
+
+class ServiceToken:
+
+    def __init__(self, auth_config, expiration=DEFAULT_TOKEN_EXPIRATION):
+        self._auth_config = auth_config
+        self._expiration = expiration
+        self._token = None
+        self._renew_at = 0
+        self._lock = threading.Lock()
+
+    def client(self):
+        return Auth(token=self.get(), **self._auth_config)
+
+    def get(self):
+        with self._lock:
+            if self._token is None or time.monotonic() >= self._renew_at:
+                data = Auth(**self._auth_config).token.new(expiration=self._expiration)
+                self._token = data['token']
+                # Renewed early to never hand out a token expiring during a warmup
+                self._renew_at = time.monotonic() + self._expiration * 0.8
+            return self._token
+
+
+class Prewarmer:
+
+    def __init__(self, auth_config, source_service, max_workers=DEFAULT_MAX_WORKERS):
+        self._service_token = ServiceToken(auth_config)
+        self._source_service = source_service
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def warm_user(self, user_uuid, tenant_uuid=None):
+        with self._lock:
+            if self._stopped.is_set() or user_uuid in self._pending:
+                return False
+            self._pending.add(user_uuid)
+
+        self._executor.submit(self._warm_user, user_uuid, tenant_uuid)
+        return True
+
+    def warm_tenant(self, tenant_uuid):
+        self._executor.submit(self._warm_tenant, tenant_uuid)
+
+    def stop(self):
+        # The queued warmups are skipped instead of delaying the stop
+        self._stopped.set()
+        self._executor.shutdown()
+
+    def _warm_tenant(self, tenant_uuid):
+        if self._stopped.is_set():
+            return
+
+        try:
+            users = self._service_token.client().users.list(tenant_uuid=tenant_uuid, recurse=False)['items']
+        except Exception as e:
+            logger.error(
+                'Unable to list the users of tenant %s to load their google contacts, error: %s',
+                tenant_uuid, e,
+            )
+            metrics.prewarms.inc(result='failure')
+            return
+
+        for user in users:
+            self.warm_user(user['uuid'], tenant_uuid)
+
+    def _warm_user(self, user_uuid, tenant_uuid):
+        try:
+            if self._stopped.is_set():
+                return
+
+            if tenant_uuid is None:
+                tenant_uuid = self._service_token.client().users.get(user_uuid)['tenant_uuid']
+
+            for source in self._source_service.list_(BACKEND, [tenant_uuid]):
+                self._warm_source(source, user_uuid)
+        except Exception:
+            logger.exception('Unexpected error while loading the google contacts of user %s', user_uuid)
+            metrics.prewarms.inc(result='failure')
+        finally:
+            with self._lock:
+                self._pending.discard(user_uuid)
+
+    def _warm_source(self, source, user_uuid):
+        google = services.GoogleService(source, used_columns(source))
+        try:
+            google_token = services.get_google_access_token(
+                user_uuid,
+                self._service_token.get(),
+                pool_size=google.pool_size,
+                engine=google.engine,
+                missing_token_ttl=google.missing_token_ttl,
+                **source['auth']
+            )
+        except GoogleTokenNotFoundException:
+            logger.debug('No google contacts to load for user %s', user_uuid)
+            metrics.prewarms.inc(result='not_linked')
+            return
+
+        # Sources without a cache are always fetched at lookup time
+        book = google.get_contact_book(google_token, user_uuid)
+        if book is None:
+            metrics.prewarms.inc(result='skipped')
+            return
+
+        logger.debug('Loaded %s google contacts of user %s from %s', len(book), user_uuid, source.get('uuid'))
+        metrics.prewarms.inc(result='warmed')
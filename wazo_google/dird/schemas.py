@@ -10,7 +10,7 @@ from wazo_dird.schemas import (
 )
 from xivo.mallow import fields
 
-from xivo.mallow.validate import Length
+from xivo.mallow.validate import Length, OneOf, Regexp
 
 
 class _AuthConfigSchema(BaseSchema):
@@ -22,9 +22,36 @@ class _AuthConfigSchema(BaseSchema):
     version = fields.String(validate=Length(min=1, max=16), missing='0.1')
 
 
+class _CacheConfigSchema(BaseSchema):
+
+    ttl = fields.Integer(validate=Range(min=0, max=86400), missing=60)
+    sync = fields.Boolean(missing=True)
+    max_stale = fields.Integer(validate=Range(min=0, max=604800), missing=86400)
+    missing_token_ttl = fields.Integer(validate=Range(min=0, max=86400), missing=60)
+    persistent = fields.Boolean(missing=False)
+
+
+class _HTTPConfigSchema(BaseSchema):
+
+    pool_size = fields.Integer(validate=Range(min=1, max=1000), missing=10)
+    timeout = fields.Float(validate=Range(min=0, max=3660), missing=10)
+    engine = fields.String(validate=OneOf(['requests', 'asyncio']), missing='requests')
+    stream = fields.Boolean(missing=True)
+
+
+class _NumberNormalizationConfigSchema(BaseSchema):
+
+    country_code = fields.String(validate=Regexp(r'^[1-9][0-9]{0,2}$'), missing=None)
+    international_prefix = fields.String(validate=Regexp(r'^[0-9]{0,4}$'), missing='00')
+    trunk_prefix = fields.String(validate=Regexp(r'^[0-9]{0,2}$'), missing='0')
+
+
 class SourceSchema(BaseSourceSchema):
 
     auth = fields.Nested(_AuthConfigSchema, missing={})
+    cache = fields.Nested(_CacheConfigSchema, missing={})
+    http = fields.Nested(_HTTPConfigSchema, missing={})
+    number_normalization = fields.Nested(_NumberNormalizationConfigSchema, missing={})
 
 
 class ListSchema(_ListSchema):
@@ -1,56 +1,1144 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import heapq
 import logging
+import re
+import threading
+import time
+import unicodedata
 
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
 from operator import itemgetter
 
 import requests
 
+from requests.adapters import HTTPAdapter
 from wazo_auth_client import Client as Auth
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+from . import async_engine, metrics, store
 from .exceptions import GoogleTokenNotFoundException
 
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_CACHE_TTL = 60
+DEFAULT_CACHE_MAX_STALE = 86400
+DEFAULT_MISSING_TOKEN_TTL = 60
+DEFAULT_CACHE_MAX_ENTRIES = 1000
+DEFAULT_CACHE_MAX_CONTACTS = 500000
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 10
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Returned instead of a feed when Google answers a conditional request with a 304
+NOT_MODIFIED = object()
+_END = object()
+
+_adapters = {}
+_sessions = {}
+_pool_lock = threading.Lock()
+
+
+def get_adapter(host, pool_size=DEFAULT_POOL_SIZE):
+    key = (host, pool_size)
+    with _pool_lock:
+        adapter = _adapters.get(key)
+        if adapter is None:
+            adapter = _adapters[key] = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        return adapter
+
+
+def get_session(host, pool_size=DEFAULT_POOL_SIZE):
+    key = (host, pool_size)
+    adapter = get_adapter(host, pool_size)
+    with _pool_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        return session
+
+
+class _PooledAuth(Auth):
+
+    def __init__(self, adapter, **kwargs):
+        super().__init__(**kwargs)
+        self._adapter = adapter
+
+    def session(self):
+        session = super().session()
+        # The client closes its connection after each request by default
+        session.headers.pop('Connection', None)
+        session.mount('https://', self._adapter)
+        session.mount('http://', self._adapter)
+        return session
+
+
+class _Page:
+
+    def __init__(self, start_index, contacts, has_next, updated, validators):
+        self.start_index = start_index
+        self.contacts = contacts
+        self.has_next = has_next
+        self.updated = updated
+        self.validators = validators
+
+
+class ContactBook:
+
+    def __init__(self, contacts, updated=None, pages=None):
+        self._contacts_by_id = OrderedDict((contact['id'], contact) for contact in contacts)
+        self.contacts = list(self._contacts_by_id.values())
+        self.updated = updated
+        self.synced_at = time.monotonic()
+        self.pages = pages or []
+        self.sync_validators = {}
+        self._first_match_indexes = {}
+        self._search_indexes = {}
+        self._sorted_contacts = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.contacts)
+
+    def to_record(self):
+        pages = [
+            [page.start_index, len(page.contacts), page.has_next, page.updated, page.validators]
+            for page in self.pages
+        ]
+        # The contacts of the pages are stored once, the pages only keep their position
+        contacts = [contact for page in self.pages for contact in page.contacts] if self.pages else self.contacts
+        return {
+            'contacts': [[contact[field] for field in Contact.__slots__] for contact in contacts],
+            'updated': self.updated,
+            'pages': pages,
+            'sync_validators': self.sync_validators,
+        }
+
+    @classmethod
+    def from_record(cls, record, age):
+        contacts = [Contact(*values) for values in record['contacts']]
+        pages, offset = [], 0
+        for start_index, count, has_next, updated, validators in record['pages']:
+            pages.append(_Page(start_index, contacts[offset:offset + count], has_next, updated, validators))
+            offset += count
+
+        book = cls(contacts, record['updated'], pages)
+        book.sync_validators = record['sync_validators']
+        book.synced_at -= age
+        return book
+
+    def is_expired(self, ttl):
+        return time.monotonic() - self.synced_at > ttl
+
+    def first_match(self, columns, term):
+        index = self._get_first_match_index(tuple(columns))
+        # The indexes are updated in place by the synchronizations
+        with self._lock:
+            matches = index.get(term.lower())
+            if matches:
+                return matches[0]
+
+    def sorted_contacts(self, order, reverse=False):
+        with self._lock:
+            contacts = self._sorted_contacts.get((order, reverse))
+            if contacts is None:
+                contacts = sorted(self.contacts, key=itemgetter(order), reverse=reverse)
+                self._sorted_contacts[(order, reverse)] = contacts
+            return contacts
+
+    def get_contacts(self, ids):
+        contacts_by_id = self._contacts_by_id
+        return [contacts_by_id[id_] for id_ in ids if id_ in contacts_by_id]
+
+    def search(self, columns, term):
+        index = self._get_search_index(tuple(columns))
+        return index.search(term)
+
+    def apply(self, updated_contacts, deleted_ids, updated):
+        with self._lock:
+            # Readers may be iterating on the current contacts, the changes are applied on a copy
+            contacts_by_id = OrderedDict(self._contacts_by_id)
+            for id_ in deleted_ids:
+                old_contact = contacts_by_id.pop(id_, None)
+                self._unindex(old_contact)
+            for contact in updated_contacts:
+                old_contact = contacts_by_id.get(contact['id'])
+                self._unindex(old_contact)
+                contacts_by_id[contact['id']] = contact
+                self._index(contact)
+
+            self._contacts_by_id = contacts_by_id
+            self.contacts = list(contacts_by_id.values())
+            self._search_indexes = {}
+            self._sorted_contacts = {}
+            self.updated = updated
+            self.synced_at = time.monotonic()
+            # The pages fetched with the book do not match its contacts anymore
+            self.pages = []
+
+    def _get_first_match_index(self, columns):
+        with self._lock:
+            index = self._first_match_indexes.get(columns)
+            if index is None:
+                index = self._first_match_indexes[columns] = {}
+                for contact in self.contacts:
+                    _add_to_index(index, _column_values(contact, columns), contact)
+            return index
+
+    def _get_search_index(self, columns):
+        with self._lock:
+            index = self._search_indexes.get(columns)
+            if index is None:
+                index = self._search_indexes[columns] = _SearchIndex(self.contacts, columns)
+            return index
+
+    def _index(self, contact):
+        for columns, index in self._first_match_indexes.items():
+            _add_to_index(index, _column_values(contact, columns), contact)
+
+    def _unindex(self, contact):
+        if contact is None:
+            return
+
+        for columns, index in self._first_match_indexes.items():
+            _remove_from_index(index, _column_values(contact, columns), contact)
+
+
+class _SearchIndex:
+
+    ngram_length = 3
+
+    def __init__(self, contacts, columns):
+        self._contacts = contacts
+        self._values = []
+        self._postings = {}
+
+        for position, contact in enumerate(contacts):
+            values = tuple(set(fold(value) for value in _column_values(contact, columns)))
+            self._values.append(values)
+            for value in values:
+                for ngram in self._ngrams(value):
+                    self._postings.setdefault(ngram, set()).add(position)
+
+    def search(self, term):
+        term = fold(term.lower())
+        if len(term) < self.ngram_length:
+            candidates = range(len(self._contacts))
+        else:
+            postings = sorted(
+                (self._postings.get(ngram, set()) for ngram in set(self._ngrams(term))),
+                key=len,
+            )
+            candidates = sorted(set.intersection(*postings))
+
+        # The ngrams of a term can match a contact without the term itself being in a value
+        return [
+            self._contacts[position] for position in candidates
+            if any(term in value for value in self._values[position])
+        ]
+
+    @classmethod
+    def _ngrams(cls, value):
+        for i in range(len(value) - cls.ngram_length + 1):
+            yield value[i:i + cls.ngram_length]
+
+
+class _SharedIterator:
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self._items = deque()
+        # The position of the first buffered item, the items read by every consumer are dropped
+        self._offset = 0
+        self._positions = {}
+        self._done = False
+        self._error = None
+        self._lock = threading.Lock()
+        self._advance_lock = threading.Lock()
+
+    def join(self):
+        with self._lock:
+            if self._offset:
+                return None
+            consumer = object()
+            self._positions[consumer] = 0
+        return self._consume(consumer)
+
+    def _consume(self, consumer):
+        try:
+            while True:
+                item = self._next(consumer)
+                if item is _END:
+                    return
+                yield item
+        finally:
+            with self._lock:
+                del self._positions[consumer]
+                self._drop_read_items()
+
+    def _next(self, consumer):
+        while True:
+            with self._lock:
+                buffered = self._buffered(consumer)
+            if buffered is _END:
+                return _END
+            if buffered is not None:
+                return buffered[0]
+
+            # The iterator is advanced by one consumer at a time, the others wait for its item
+            with self._advance_lock:
+                with self._lock:
+                    if self._has_buffered(consumer):
+                        continue
+                try:
+                    item = next(self._iterator)
+                except StopIteration:
+                    with self._lock:
+                        self._done = True
+                except Exception as e:
+                    with self._lock:
+                        self._error = e
+                else:
+                    with self._lock:
+                        self._items.append(item)
+
+    def _has_buffered(self, consumer):
+        if self._positions[consumer] - self._offset < len(self._items):
+            return True
+        return self._done or self._error is not None
+
+    def _buffered(self, consumer):
+        position = self._positions[consumer]
+        if position - self._offset < len(self._items):
+            item = self._items[position - self._offset]
+            self._positions[consumer] = position + 1
+            self._drop_read_items()
+            return (item,)
+        if self._error is not None:
+            raise self._error
+        if self._done:
+            return _END
+
+    def _drop_read_items(self):
+        if not self._positions:
+            return
+        oldest = min(self._positions.values())
+        while self._items and self._offset < oldest:
+            self._items.popleft()
+            self._offset += 1
+
+    def close(self):
+        with self._advance_lock:
+            close = getattr(self._iterator, 'close', None)
+            if close:
+                close()
+
+
+class InFlightRequests:
+
+    def __init__(self):
+        self._requests = {}
+        self._lock = threading.Lock()
+
+    def iterate(self, key, function, *args):
+        with self._lock:
+            request = self._requests.get(key)
+            consumer = request[0].join() if request is not None else None
+            if consumer is None:
+                # Requests whose first items were already dropped cannot be joined, they are sent again
+                request = self._requests[key] = [_SharedIterator(function(*args)), 0]
+                consumer = request[0].join()
+            request[1] += 1
+
+        try:
+            yield from consumer
+        finally:
+            with self._lock:
+                request[1] -= 1
+                last = request[1] == 0
+                if last and self._requests.get(key) is request:
+                    del self._requests[key]
+            if last:
+                request[0].close()
+
+    def call(self, key, function, *args):
+        results = self.iterate(key, _lazy_call, function, *args)
+        try:
+            return next(results)
+        finally:
+            results.close()
+
+    def __len__(self):
+        return len(self._requests)
+
+
+def _lazy_call(function, *args):
+    yield function(*args)
+
+
+class _Counter:
+
+    def __init__(self, iterable):
+        self._iterable = iterable
+        self.count = 0
+
+    def __iter__(self):
+        for item in self._iterable:
+            self.count += 1
+            yield item
+
+
+class _ResponseStream:
+
+    def __init__(self, response, chunk_size=STREAM_CHUNK_SIZE):
+        self._chunks = response.iter_content(chunk_size)
+        self.received = 0
+
+    def read(self, size=-1):
+        # ijson reads 0 bytes to detect the type of the stream
+        if size == 0:
+            return b''
+
+        for chunk in self._chunks:
+            if chunk:
+                self.received += len(chunk)
+                return chunk
+        return b''
+
+
+def _iter_feed_entries(stream, feed_info):
+    builder = None
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if builder is not None:
+            if prefix == 'feed.entry.item' and event == 'end_map':
+                yield builder.value
+                builder = None
+            else:
+                builder.event(event, value)
+        elif prefix == 'feed.entry.item' and event == 'start_map':
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+        elif prefix == 'feed.link.item.rel' and value == 'next':
+            feed_info['next'] = True
+
+
+def fold(value):
+    return ''.join(c for c in unicodedata.normalize('NFKD', value) if not unicodedata.combining(c))
+
+
+def _column_values(contact, columns):
+    for column in columns:
+        column_value = contact.get(column) or ''
+        if not isinstance(column_value, (dict, list)):
+            yield str(column_value).lower()
+        else:
+            for value in column_value:
+                yield value.lower()
+
+
+def _add_to_index(index, values, contact):
+    # Contacts are compared by identity, comparing their values made the build quadratic
+    for value in set(values):
+        index.setdefault(value, []).append(contact)
+
+
+def _remove_from_index(index, values, contact):
+    for value in set(values):
+        matches = index.get(value)
+        if not matches:
+            continue
+
+        for position, match in enumerate(matches):
+            if match is contact:
+                del matches[position]
+                break
+        if not matches:
+            del index[value]
+
+
+class ContactCache:
+
+    def __init__(self, max_entries=DEFAULT_CACHE_MAX_ENTRIES, max_contacts=DEFAULT_CACHE_MAX_CONTACTS):
+        self.max_entries = max_entries
+        self.max_contacts = max_contacts
+        self._books = OrderedDict()
+        self._nb_contacts = 0
+        # Incremented when the books of a user are deleted, to discard the fetches started before
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._books.get(key)
+            if entry is None:
+                return None
+
+            self._books.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, book, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generations.get(key[1], 0):
+                logger.debug('discarding google contacts of %s fetched before their deletion', key)
+                return False
+
+            if key in self._books:
+                self._remove(key)
+
+            # The size is kept since synchronizing a book changes its length
+            self._books[key] = (book, len(book))
+            self._nb_contacts += len(book)
+            self._evict()
+            return True
+
+    def generation(self, user_uuid):
+        with self._lock:
+            return self._generations.get(user_uuid, 0)
+
+    def delete_user(self, user_uuid):
+        with self._lock:
+            self._generations[user_uuid] = self._generations.get(user_uuid, 0) + 1
+            for key in [key for key in self._books if key[1] == user_uuid]:
+                self._remove(key)
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._books:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._books.clear()
+            self._nb_contacts = 0
+
+    def __len__(self):
+        return len(self._books)
+
+    def _evict(self):
+        # The number of cached contacts is used as an approximation of the memory used
+        while self._books and (
+            len(self._books) > self.max_entries or self._nb_contacts > self.max_contacts
+        ):
+            key = next(iter(self._books))
+            logger.debug('evicting google contacts of %s from the cache', key)
+            self._remove(key)
+
+    def _remove(self, key):
+        _, size = self._books.pop(key)
+        self._nb_contacts -= size
+
+
+contact_cache = ContactCache()
+# Serializes the saved books with the deletion of the books of a user
+_user_books_lock = threading.Lock()
+in_flight_requests = InFlightRequests()
+_refresh_executor = ThreadPoolExecutor(max_workers=DEFAULT_POOL_SIZE)
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+class TokenCache:
+
+    # wazo-auth refreshes tokens expiring in less than 30 seconds
+    expiration_margin = 60
+
+    def __init__(self):
+        self._tokens = {}
+        self._keys = {}
+        self._missing = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._tokens.get(key)
+            if entry is None:
+                return None
+
+            access_token, expiration = entry
+            if time.time() + self.expiration_margin >= expiration:
+                self._remove(key)
+                return None
+
+            return access_token
+
+    def set(self, key, access_token, expiration):
+        if not access_token or not expiration:
+            return
+
+        with self._lock:
+            if key in self._tokens:
+                self._remove(key)
+            self._tokens[key] = (access_token, expiration)
+            self._keys[access_token] = key
+
+    def is_missing(self, key):
+        with self._lock:
+            expiration = self._missing.get(key)
+            if expiration is None:
+                return False
+
+            if time.monotonic() >= expiration:
+                del self._missing[key]
+                return False
+
+            return True
+
+    def set_missing(self, key, ttl):
+        if not ttl:
+            return
+
+        with self._lock:
+            self._missing[key] = time.monotonic() + ttl
+
+    def invalidate(self, access_token):
+        with self._lock:
+            key = self._keys.get(access_token)
+            if key is not None:
+                logger.debug('invalidating the google token of %s', key)
+                self._remove(key)
+
+    def invalidate_user(self, user_uuid):
+        with self._lock:
+            for key in [key for key in self._missing if key[1] == user_uuid]:
+                del self._missing[key]
+            for key in [key for key in self._tokens if key[1] == user_uuid]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+            self._keys.clear()
+            self._missing.clear()
+
+    def _remove(self, key):
+        access_token, _ = self._tokens.pop(key)
+        self._keys.pop(access_token, None)
+
+
+token_cache = TokenCache()
+
+
+def delete_user_books(user_uuid):
+    with _user_books_lock:
+        contact_cache.delete_user(user_uuid)
+        store.delete_user(user_uuid)
+
 
 class GoogleService:
 
-    USER_AGENT = 'wazo_ua/1.0'
+    PAGE_SIZE = 1000
+    # The columns used to filter cached contacts, matching the fields searched by Google
+    searched_columns = ('name', 'numbers', 'emails')
+    # Google only compresses the responses of clients with gzip in their user agent
+    USER_AGENT = 'wazo_ua/1.0 (gzip)'
+    # The fields of a Google entry read by the formatter to build each column
+    column_fields = {
+        'id': ('id',),
+        'name': ('title',),
+        'numbers': ('gd:phoneNumber',),
+        'numbers_by_label': ('gd:phoneNumber',),
+        'normalized_numbers': ('gd:phoneNumber',),
+        'emails': ('gd:email',),
+    }
+    feed_fields = ('link', 'updated')
+    host = 'google.com'
     url = 'https://google.com/m8/feeds/contacts/default/full'
 
-    def __init__(self):
-        self.formatter = ContactFormatter()
+    def __init__(self, config=None, columns=None):
+        config = config or {}
+        cache_config = config.get('cache') or {}
+        http_config = config.get('http') or {}
+        self.timeout = http_config.get('timeout', DEFAULT_TIMEOUT)
+        self.pool_size = http_config.get('pool_size', DEFAULT_POOL_SIZE)
+        self.session = get_session(self.host, self.pool_size)
+        self.engine = None
+        if http_config.get('engine') == 'asyncio':
+            self.engine = async_engine.get_engine(self.pool_size)
+        self.stream = http_config.get('stream', True) and ijson is not None and self.engine is None
+        self.normalizer = PhoneNumberNormalizer.from_config(config)
+        self.formatter = ContactFormatter(self.normalizer)
+        self.source_uuid = config.get('uuid')
+        self.cache_ttl = cache_config.get('ttl', DEFAULT_CACHE_TTL)
+        self.cache_sync = cache_config.get('sync', True)
+        self.cache_max_stale = cache_config.get('max_stale', DEFAULT_CACHE_MAX_STALE)
+        self.missing_token_ttl = cache_config.get('missing_token_ttl', DEFAULT_MISSING_TOKEN_TTL)
+        self.entry_fields = self._entry_fields(columns)
+        self.store = None
+        if cache_config.get('persistent'):
+            self.store = store.get_store()
+        self._fields = ','.join(('entry({})'.format(','.join(self.entry_fields)),) + self.feed_fields)
+        self._contact_fields = ','.join(self.entry_fields)
+
+    def get_contacts_with_term(self, google_token, term, user_uuid=None, limit=None):
+        book = self.get_contact_book(google_token, user_uuid)
+        if book is None:
+            contacts = self._fetch(google_token, term=term)
+        else:
+            contacts = self._filter(book, term)
 
-    def get_contacts_with_term(self, google_token, term):
-        for contact in self._fetch(google_token, term=term):
+        # Stopping the iteration early avoids fetching the remaining pages
+        for contact in islice(contacts, limit):
             yield contact
 
-    def get_contacts(self, google_token, **list_params):
-        contacts = list(self._fetch(google_token, term=list_params.get('search')))
-        total = len(contacts)
-        sorted_contacts = self._sort(contacts, **list_params)
-        paginated_contacts = self._paginate(sorted_contacts, **list_params)
-        return paginated_contacts, total
+    def get_contacts_by_ids(self, google_token, unique_ids, user_uuid=None):
+        unique_ids = list(OrderedDict.fromkeys(unique_ids))
+        if not unique_ids:
+            return []
+
+        # A favorites list should not trigger the download of all the contacts
+        book = self.get_contact_book(google_token, user_uuid, fetch=False)
+        if book is not None:
+            return book.get_contacts(unique_ids)
+
+        if self.engine is not None:
+            return self._get_contacts_with_engine(google_token, unique_ids)
+
+        with ThreadPoolExecutor(max_workers=min(self.pool_size, len(unique_ids))) as executor:
+            contacts = executor.map(partial(self._get_contact, google_token), unique_ids)
+            return [contact for contact in contacts if contact]
+
+    def _get_contacts_with_engine(self, google_token, unique_ids):
+        with metrics.google_request_duration.time(endpoint='contact'):
+            responses = self.engine.run(self.engine.gather_json(
+                ['{}/{}'.format(self.url, id_) for id_ in unique_ids],
+                headers=self.headers(google_token),
+                params={'alt': 'json', 'fields': self._contact_fields},
+                timeout=self.timeout,
+                verify=False,
+            ))
+
+        contacts = []
+        for status_code, body in responses:
+            body = self._handle_response(google_token, status_code, body, 'contact')
+            if body and 'entry' in body:
+                metrics.google_received_contacts.inc()
+                contacts.append(self.formatter.format(body['entry']))
+        return contacts
+
+    def get_contacts(self, google_token, user_uuid=None, **list_params):
+        term = list_params.get('search')
+        order = list_params.get('order')
+        book = self.get_contact_book(google_token, user_uuid)
+        if book is None:
+            contacts = _Counter(self._fetch(google_token, term=term))
+            sorted_contacts = self._sort(contacts, **list_params) if order else list(contacts)
+            return self._paginate(sorted_contacts, **list_params), contacts.count
+
+        if term:
+            contacts = book.search(self.searched_columns, term)
+            sorted_contacts = self._sort(contacts, **list_params)
+        elif order:
+            contacts = book.contacts
+            sorted_contacts = book.sorted_contacts(order, list_params.get('direction') == 'desc')
+        else:
+            contacts = sorted_contacts = book.contacts
+
+        return self._paginate(sorted_contacts, **list_params), len(contacts)
+
+    def get_contact_book(self, google_token, user_uuid, fetch=True):
+        if not self.cache_ttl or not self.source_uuid or not user_uuid:
+            return None
+
+        key = (self.source_uuid, user_uuid)
+        if self.entry_fields != self._entry_fields():
+            # Books fetched with fewer fields cannot be shared with the lookups using all the columns
+            key += (self.entry_fields,)
+        book = contact_cache.get(key)
+        if book is None and self.store is not None:
+            book = self._load(key)
+        if book is not None and not book.is_expired(self.cache_ttl):
+            logger.debug('Using cached google contacts for %s', key)
+            metrics.cache_requests.inc(cache='contacts', result='hit')
+            return book
+
+        # Expired contacts are served while they are refreshed, only the first fetch is waited for
+        if book is not None and not book.is_expired(self.cache_ttl + self.cache_max_stale):
+            metrics.cache_requests.inc(cache='contacts', result='stale')
+            self._refresh_in_background(google_token, key, book)
+            return book
+
+        metrics.cache_requests.inc(cache='contacts', result='miss' if book is None else 'expired')
+        if not fetch:
+            return None
+
+        return self._refresh(google_token, key, book)
+
+    def _refresh(self, google_token, key, book):
+        # Refreshes started before the books of the user were deleted are not joined
+        generation = contact_cache.generation(key[1])
+        return in_flight_requests.call(
+            ('book', generation) + key, self._refresh_book, google_token, key, book, generation,
+        )
+
+    def _refresh_book(self, google_token, key, book, generation):
+        if book is not None and self.cache_sync and book.updated:
+            changed = self._sync(google_token, book)
+            if changed is not None:
+                self._cache(key, book, generation, changed)
+                return book
+
+        refreshed_book = self._fetch_book(google_token, book)
+        if refreshed_book is None:
+            return None
+
+        self._cache(key, refreshed_book, generation, refreshed_book is not book)
+        return refreshed_book
+
+    def _cache(self, key, book, generation, changed=True):
+        # Unchanged contacts are already stored, only their age is updated
+        record = book.to_record() if self.store is not None and changed else None
+        with _user_books_lock:
+            if not contact_cache.set(key, book, generation) or self.store is None:
+                return
+
+            saved_at = time.time() - (time.monotonic() - book.synced_at)
+            try:
+                if record is None and self.store.touch(key, saved_at):
+                    return
+                if record is None:
+                    record = book.to_record()
+                self.store.save(key, saved_at, record)
+            except Exception as e:
+                logger.error('Unable to store the google contacts of %s, error: %s', key, e)
+
+    def _load(self, key):
+        generation = contact_cache.generation(key[1])
+        try:
+            stored = self.store.load(key)
+        except Exception as e:
+            logger.error('Unable to load the stored google contacts of %s, error: %s', key, e)
+            return None
+
+        if stored is None:
+            return None
+
+        saved_at, record = stored
+        book = ContactBook.from_record(record, max(time.time() - saved_at, 0))
+        logger.debug('Loaded %s stored google contacts for %s', len(book), key)
+        metrics.cache_requests.inc(cache='store', result='hit')
+        contact_cache.set(key, book, generation)
+        return book
+
+    def _refresh_in_background(self, google_token, key, book):
+        with _refreshing_lock:
+            if key in _refreshing:
+                return
+            _refreshing.add(key)
+
+        _refresh_executor.submit(self._background_refresh, google_token, key, book)
+
+    def _background_refresh(self, google_token, key, book):
+        try:
+            refreshed_book = self._refresh(google_token, key, book)
+        except Exception:
+            logger.exception('Unexpected error while refreshing the google contacts of %s', key)
+            refreshed_book = None
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+
+        if refreshed_book is None:
+            logger.info('Failed to refresh the google contacts of %s, the cached contacts are kept', key)
+            metrics.cache_refreshes.inc(result='failure')
+        else:
+            metrics.cache_refreshes.inc(result='success')
+
+    def _fetch_book(self, google_token, previous_book=None):
+        previous_pages = {}
+        if previous_book is not None:
+            previous_pages = {page.start_index: page for page in previous_book.pages}
+
+        pages, start_index = [], 1
+        while True:
+            previous_page = previous_pages.get(start_index)
+            validators = dict(previous_page.validators) if previous_page else {}
+            feed = self._get(google_token, validators=validators, **{'start-index': start_index})
+            if feed is None:
+                return None
+
+            if feed is NOT_MODIFIED:
+                # The contacts parsed from the previous response are reused without decoding anything
+                page = previous_page
+            else:
+                page = _Page(
+                    start_index,
+                    [self.formatter.format(contact) for contact in self._entries(feed)],
+                    self._has_next_page(feed),
+                    self._updated(feed),
+                    validators,
+                )
+            pages.append(page)
+
+            if not page.contacts or not page.has_next:
+                break
+            start_index += len(page.contacts)
+
+        if previous_book is not None and pages == previous_book.pages:
+            logger.debug('Google contacts not modified')
+            previous_book.synced_at = time.monotonic()
+            return previous_book
+
+        contacts = [contact for page in pages for contact in page.contacts]
+        # The first page is used to avoid missing changes made while fetching the other pages
+        return ContactBook(contacts, pages[0].updated, pages)
+
+    def _sync(self, google_token, book):
+        updated_contacts, deleted_ids, updated = [], [], None
+        query_params = {'updated-min': book.updated, 'showdeleted': 'true'}
+        validators = dict(book.sync_validators)
+        for feed in self._get_pages(google_token, validators=validators, **query_params):
+            if feed is None:
+                logger.info('Incremental google contacts synchronization failed, fetching all contacts')
+                return None
+
+            if feed is NOT_MODIFIED:
+                logger.debug('Google contacts not modified since %s', book.updated)
+                book.synced_at = time.monotonic()
+                return False
+
+            # Validators are only kept for changes fitting in a single page
+            if self._has_next_page(feed):
+                validators = {}
+
+            updated = updated or self._updated(feed)
+            for entry in self._entries(feed):
+                contact = self.formatter.format(entry)
+                if 'gd$deleted' in entry:
+                    deleted_ids.append(contact['id'])
+                else:
+                    updated_contacts.append(contact)
+
+        logger.debug(
+            'Synchronized google contacts: %s updated %s deleted',
+            len(updated_contacts), len(deleted_ids),
+        )
+        book.apply(updated_contacts, deleted_ids, updated or book.updated)
+        book.sync_validators = validators
+        return True
 
     def _fetch(self, google_token, term=None):
-        headers = self.headers(google_token)
+        # Concurrent lookups of the same contacts share the Google requests and the formatted contacts
+        # Contacts fetched with fewer fields cannot be shared with the lookups using all the columns
+        key = ('contacts', self.source_uuid, self.entry_fields, google_token, term)
+        return in_flight_requests.iterate(key, self._fetch_contacts, google_token, term)
+
+    def _fetch_contacts(self, google_token, term=None):
+        query_params = {'q': term} if term else {}
+        if self.stream:
+            entries = self._stream_pages(google_token, **query_params)
+        else:
+            entries = self._iter_pages(google_token, **query_params)
+
+        for entry in entries:
+            yield self.formatter.format(entry)
+
+    def _iter_pages(self, google_token, **params):
+        for feed in self._get_pages(google_token, **params):
+            if feed is None:
+                return
+
+            yield from self._entries(feed)
+
+    def _stream_pages(self, google_token, start_index=1, **params):
+        while True:
+            feed_info = {'count': 0, 'next': False}
+            page_params = dict(params, **{'start-index': start_index})
+            yield from self._stream_entries(google_token, feed_info, **page_params)
+
+            if not feed_info['count'] or not feed_info['next']:
+                return
+
+            start_index += feed_info['count']
+
+    def _stream_entries(self, google_token, feed_info, **params):
         query_params = {
             'alt': 'json',
-            'max-results': 1000,
+            'max-results': self.PAGE_SIZE,
+            'fields': self._fields,
         }
-        if term:
-            query_params['q'] = term
+        query_params.update(params)
 
-        # TODO find a way to remove this verify = False
-        response = requests.get(self.url, headers=headers, params=query_params, verify=False)
-        if response.status_code != 200:
-            return []
+        try:
+            with metrics.google_request_duration.time(endpoint='contacts'):
+                response = self.session.get(
+                    self.url,
+                    headers=self.headers(google_token),
+                    params=query_params,
+                    verify=False,
+                    timeout=self.timeout,
+                    stream=True,
+                )
+        except requests.exceptions.RequestException as e:
+            logger.error('Unable to fetch contacts from google, error: %s', e)
+            metrics.google_responses.inc(endpoint='contacts', status='error')
+            return
+
+        with response:
+            if response.status_code != 200:
+                self._handle_response(google_token, response.status_code, None, 'contacts')
+                return
+
+            metrics.google_responses.inc(endpoint='contacts', status=200)
+            # Entries are parsed as they are received instead of loading the whole feed
+            stream = _ResponseStream(response)
+            try:
+                for entry in _iter_feed_entries(stream, feed_info):
+                    feed_info['count'] += 1
+                    yield entry
+            except (ijson.JSONError, requests.exceptions.RequestException) as e:
+                logger.error('Unable to read the google contacts feed, error: %s', e)
+            finally:
+                metrics.google_received_bytes.inc(stream.received, endpoint='contacts')
+                metrics.google_received_contacts.inc(feed_info['count'])
+
+    def _get_pages(self, google_token, start_index=1, validators=None, **params):
+        while True:
+            page_params = dict(params, **{'start-index': start_index})
+            if validators is not None:
+                # Only the first page is requested conditionally
+                feed = self._get(google_token, validators=validators, **page_params)
+                validators = None
+            else:
+                feed = self._get(google_token, **page_params)
+            yield feed
+
+            if feed is None or feed is NOT_MODIFIED:
+                return
+
+            entries = self._entries(feed)
+            if not entries or not self._has_next_page(feed):
+                return
+
+            start_index += len(entries)
+
+    def _get(self, google_token, validators=None, **params):
+        query_params = {
+            'alt': 'json',
+            'max-results': self.PAGE_SIZE,
+            'fields': self._fields,
+        }
+        query_params.update(params)
+
+        body = self._request(google_token, self.url, query_params, validators)
+        if body is None or body is NOT_MODIFIED:
+            return body
 
         logger.debug('Sucessfully fetched contacts from google')
-        for contact in response.json().get('feed', {}).get('entry', []):
-            yield self.formatter.format(contact)
+        feed = body.get('feed', {})
+        metrics.google_received_contacts.inc(len(self._entries(feed)))
+        return feed
+
+    def _get_contact(self, google_token, id_):
+        url = '{}/{}'.format(self.url, id_)
+        body = self._request(google_token, url, {'alt': 'json', 'fields': self._contact_fields})
+        if body is None or 'entry' not in body:
+            return None
+
+        metrics.google_received_contacts.inc()
+        return self.formatter.format(body['entry'])
+
+    def _request(self, google_token, url, query_params, validators=None):
+        endpoint = 'contacts' if url == self.url else 'contact'
+        if self.engine is not None:
+            with metrics.google_request_duration.time(endpoint=endpoint):
+                status_code, body = self.engine.run(self.engine.get_json(
+                    url,
+                    headers=self.headers(google_token),
+                    params=query_params,
+                    timeout=self.timeout,
+                    verify=False,
+                ))
+            return self._handle_response(google_token, status_code, body, endpoint)
+
+        headers = self.headers(google_token)
+        if validators:
+            headers.update(self._conditional_headers(validators))
+
+        try:
+            # TODO find a way to remove this verify = False
+            with metrics.google_request_duration.time(endpoint=endpoint):
+                response = self.session.get(
+                    url,
+                    headers=headers,
+                    params=query_params,
+                    verify=False,
+                    timeout=self.timeout,
+                )
+        except requests.exceptions.RequestException as e:
+            logger.error('Unable to fetch contacts from google, error: %s', e)
+            metrics.google_responses.inc(endpoint=endpoint, status='error')
+            return None
+
+        if response.status_code == 304 and validators:
+            metrics.google_responses.inc(endpoint=endpoint, status=304)
+            return NOT_MODIFIED
+
+        if response.status_code != 200:
+            return self._handle_response(google_token, response.status_code, None, endpoint)
+
+        metrics.google_responses.inc(endpoint=endpoint, status=200)
+        metrics.google_received_bytes.inc(len(response.content), endpoint=endpoint)
+        if validators is not None:
+            validators.clear()
+            validators.update(self._response_validators(response))
+        return response.json()
+
+    @staticmethod
+    def _conditional_headers(validators):
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    @staticmethod
+    def _response_validators(response):
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        return {name: value for name, value in validators.items() if value}
+
+    @staticmethod
+    def _handle_response(google_token, status_code, body, endpoint):
+        metrics.google_responses.inc(endpoint=endpoint, status=status_code or 'error')
+        if status_code == 401:
+            token_cache.invalidate(google_token)
+
+        if status_code != 200:
+            return None
+
+        return body
+
+    @staticmethod
+    def _has_next_page(feed):
+        return any(link.get('rel') == 'next' for link in feed.get('link', []))
+
+    @staticmethod
+    def _entries(feed):
+        return feed.get('entry', [])
+
+    @staticmethod
+    def _updated(feed):
+        return feed.get('updated', {}).get('$t')
+
+    def _filter(self, book, term):
+        if not term:
+            return list(book.contacts)
+        return book.search(self.searched_columns, term)
 
     def _paginate(self, contacts, limit=None, offset=None, **_):
         if limit is None and offset is None:
@@ -66,26 +1154,85 @@ class GoogleService:
 
         return end[:limit]
 
-    def _sort(self, contacts, order=None, direction=None, **_):
+    def _sort(self, contacts, order=None, direction=None, limit=None, offset=None, **_):
         if not order:
             return contacts
 
         reverse = direction == 'desc'
-        return sorted(contacts, key=itemgetter(order), reverse=reverse)
+        if limit is None:
+            return sorted(contacts, key=itemgetter(order), reverse=reverse)
+
+        # Only the contacts up to the end of the requested page are kept
+        select = heapq.nlargest if reverse else heapq.nsmallest
+        return select((offset or 0) + limit, contacts, key=itemgetter(order))
 
     def headers(self, google_token):
         return {
             'User-Agent': self.USER_AGENT,
             'Authorization': 'Bearer {}'.format(google_token),
             'Accept': 'application/json',
+            'Accept-Encoding': 'gzip',
         }
 
+    @classmethod
+    def _entry_fields(cls, columns=None):
+        if columns is None:
+            columns = cls.column_fields
+
+        # Deleted entries are flagged in the synchronization responses
+        fields = {'id', 'gd:deleted'}
+        for column in columns:
+            fields.update(cls.column_fields.get(column, ()))
+        return tuple(sorted(fields))
+
+
+def get_google_access_token(user_uuid, wazo_token, pool_size=DEFAULT_POOL_SIZE, engine=None,
+                            missing_token_ttl=DEFAULT_MISSING_TOKEN_TTL, **auth_config):
+    host = '{}:{}'.format(auth_config.get('host'), auth_config.get('port'))
+    key = (host, user_uuid)
+    access_token = token_cache.get(key)
+    metrics.cache_requests.inc(cache='token', result='hit' if access_token else 'miss')
+    if access_token:
+        return access_token
+
+    if token_cache.is_missing(key):
+        logger.debug('No google account linked to user %s', user_uuid)
+        metrics.cache_requests.inc(cache='missing_token', result='hit')
+        raise GoogleTokenNotFoundException(user_uuid)
+
+    try:
+        with metrics.auth_request_duration.time():
+            if engine is not None:
+                data = _get_external_auth_with_engine(engine, user_uuid, wazo_token, **auth_config)
+            else:
+                data = _get_external_auth(user_uuid, wazo_token, get_adapter(host, pool_size), **auth_config)
+    except _GoogleAccountNotLinked:
+        # Users without a linked account would otherwise query wazo-auth on every lookup
+        token_cache.set_missing(key, missing_token_ttl)
+        raise GoogleTokenNotFoundException(user_uuid)
+
+    if data is None:
+        return None
+
+    access_token = data.get('access_token')
+    token_cache.set(key, access_token, data.get('token_expiration'))
+    return access_token
 
-def get_google_access_token(user_uuid, wazo_token, **auth_config):
+
+class _GoogleAccountNotLinked(Exception):
+    pass
+
+
+def _get_external_auth(user_uuid, wazo_token, adapter, **auth_config):
     try:
-        auth = Auth(token=wazo_token, **auth_config)
-        return auth.external.get('google', user_uuid).get('access_token')
+        auth = _PooledAuth(adapter, token=wazo_token, **auth_config)
+        data = auth.external.get('google', user_uuid)
     except requests.HTTPError as e:
+        status_code = getattr(e.response, 'status_code', None)
+        metrics.auth_responses.inc(status=status_code or 'error')
+        if status_code == 404:
+            logger.debug('No google account linked to user %s', user_uuid)
+            raise _GoogleAccountNotLinked()
         logger.error('Google token could not be fetched from wazo-auth, error: %s', e)
         raise GoogleTokenNotFoundException(user_uuid)
     except requests.exceptions.ConnectionError as e:
@@ -93,23 +1240,136 @@ def get_google_access_token(user_uuid, wazo_token, **auth_config):
             'Unable to connect auth-client for the given parameters: %s, error: %s.',
             auth_config, e,
         )
+        metrics.auth_responses.inc(status='error')
         raise GoogleTokenNotFoundException(user_uuid)
     except requests.exceptions.RequestException as e:
         logger.error('Error occured while connecting to wazo-auth, error: %s', e)
+        metrics.auth_responses.inc(status='error')
+        return None
+
+    metrics.auth_responses.inc(status=200)
+    return data
+
+
+def _get_external_auth_with_engine(engine, user_uuid, wazo_token, **auth_config):
+    status_code, body = engine.run(engine.get_external_auth(user_uuid, wazo_token, **auth_config))
+    metrics.auth_responses.inc(status=status_code or 'error')
+    if status_code is None:
+        logger.error('Unable to connect to wazo-auth for the given parameters: %s', auth_config)
+        raise GoogleTokenNotFoundException(user_uuid)
+
+    if status_code == 404:
+        logger.debug('No google account linked to user %s', user_uuid)
+        raise _GoogleAccountNotLinked()
+
+    if status_code != 200:
+        logger.error('Google token could not be fetched from wazo-auth, status: %s', status_code)
+        raise GoogleTokenNotFoundException(user_uuid)
+
+    return body
+
+
+class PhoneNumberNormalizer:
+
+    _separators = str.maketrans('', '', ' -()./\u00a0')
+    _number_re = re.compile(r'^\+?[0-9]+$')
+
+    def __init__(self, country_code=None, international_prefix='00', trunk_prefix='0'):
+        self.country_code = country_code
+        self.international_prefix = international_prefix
+        self.trunk_prefix = trunk_prefix
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(**(config.get('number_normalization') or {}))
+
+    def canonical(self, number):
+        stripped = number.translate(self._separators)
+        # Names and emails are not numbers, their separators must be kept
+        if not self._number_re.match(stripped):
+            return number
+
+        number = stripped
+        if number.startswith('+'):
+            return number
+
+        if self.international_prefix and number.startswith(self.international_prefix):
+            return '+' + number[len(self.international_prefix):]
+
+        if self.country_code and self.trunk_prefix and number.startswith(self.trunk_prefix):
+            return '+' + self.country_code + number[len(self.trunk_prefix):]
+
+        return number
+
+    def variants(self, number):
+        canonical = self.canonical(number)
+        variants = [canonical]
+        if not canonical.startswith('+'):
+            return variants
+
+        digits = canonical[1:]
+        if self.international_prefix:
+            variants.append(self.international_prefix + digits)
+        if self.country_code and digits.startswith(self.country_code):
+            national_number = digits[len(self.country_code):]
+            variants.append((self.trunk_prefix or '') + national_number)
+        return variants
+
+
+class Contact(Mapping):
+
+    __slots__ = ('id', 'name', 'numbers_by_label', 'numbers', 'normalized_numbers', 'emails')
+
+    def __init__(self, id, name, numbers_by_label, numbers, normalized_numbers, emails):
+        self.id = id
+        self.name = name
+        self.numbers_by_label = numbers_by_label
+        self.numbers = numbers
+        self.normalized_numbers = normalized_numbers
+        self.emails = emails
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __repr__(self):
+        return '<Contact {}>'.format(dict(self))
 
 
 class ContactFormatter:
 
-    chars_to_remove = [' ', '-', '(', ')']
+    chars_to_remove = ' -()'
+    _chars_to_remove_table = str.maketrans('', '', chars_to_remove)
+
+    def __init__(self, normalizer=None):
+        self.normalizer = normalizer or PhoneNumberNormalizer()
 
     def format(self, contact):
-        return {
-            'id': self._extract_id(contact),
-            'name': self._extract_name(contact),
-            'numbers_by_label': self._extract_numbers_by_label(contact),
-            'numbers': self._extract_numbers(contact),
-            'emails': self._extract_emails(contact),
-        }
+        numbers_by_label = self._extract_numbers_by_label(contact)
+        numbers = self._extract_numbers(numbers_by_label)
+        return Contact(
+            self._extract_id(contact),
+            self._extract_name(contact),
+            numbers_by_label,
+            numbers,
+            self._normalize_numbers(numbers),
+            self._extract_emails(contact),
+        )
+
+    def _normalize_numbers(self, numbers):
+        normalized_numbers = []
+        for number in numbers:
+            for variant in self.normalizer.variants(number):
+                if variant not in normalized_numbers:
+                    normalized_numbers.append(variant)
+        return normalized_numbers
 
     @classmethod
     def _extract_emails(cls, contact):
@@ -121,9 +1381,8 @@ class ContactFormatter:
             emails.append(address)
         return emails
 
-    @classmethod
-    def _extract_numbers(cls, contact):
-        numbers_by_label = cls._extract_numbers_by_label(contact)
+    @staticmethod
+    def _extract_numbers(numbers_by_label):
         numbers = []
         mobile = None
 
@@ -159,10 +1418,7 @@ class ContactFormatter:
             if not number:
                 continue
 
-            for char in cls.chars_to_remove:
-                number = number.replace(char, '')
-
-            numbers[type_] = number
+            numbers[type_] = number.translate(cls._chars_to_remove_table)
 
         return numbers
 
@@ -0,0 +1,124 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE_PATH = '/var/lib/wazo-dird/google-contacts.sqlite'
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS google_contact_book (
+    source_uuid TEXT NOT NULL,
+    user_uuid TEXT NOT NULL,
+    fields TEXT NOT NULL,
+    saved_at REAL NOT NULL,
+    record TEXT NOT NULL,
+    PRIMARY KEY (source_uuid, user_uuid, fields)
+)
+'''
+
+
+def get_store(path=DEFAULT_STORE_PATH):
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            try:
+                store = ContactStore(path)
+            except (OSError, sqlite3.Error) as e:
+                logger.error('Unable to open the google contacts store %s, error: %s', path, e)
+                return None
+            _stores[path] = store
+        return store
+
+
+def delete_user(user_uuid, path=DEFAULT_STORE_PATH):
+    with _stores_lock:
+        paths = set(_stores)
+    # The store is opened on the first lookup of a persistent source, it can exist before that
+    if os.path.exists(path):
+        paths.add(path)
+
+    for path in paths:
+        store = get_store(path)
+        if store is not None:
+            store.delete_user(user_uuid)
+
+
+class ContactStore:
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        try:
+            self._connection = self._connect()
+        except sqlite3.DatabaseError as e:
+            # A corrupted store only contains copies of Google contacts, it is started over
+            logger.error('Google contacts store %s is corrupted, error: %s', path, e)
+            os.replace(path, path + '.corrupted')
+            self._connection = self._connect()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        # The write-ahead log keeps the stored books intact when dird stops while writing
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(SCHEMA)
+        return connection
+
+    def load(self, key):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT saved_at, record FROM google_contact_book '
+                'WHERE source_uuid = ? AND user_uuid = ? AND fields = ?',
+                self._encode_key(key),
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        saved_at, record = row
+        try:
+            return saved_at, json.loads(record)
+        except ValueError as e:
+            logger.error('Invalid stored google contacts for %s, error: %s', key, e)
+            return None
+
+    def save(self, key, saved_at, record):
+        data = json.dumps(record, separators=(',', ':'))
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO google_contact_book VALUES (?, ?, ?, ?, ?)',
+                self._encode_key(key) + (saved_at, data),
+            )
+
+    def touch(self, key, saved_at):
+        with self._lock:
+            cursor = self._connection.execute(
+                'UPDATE google_contact_book SET saved_at = ? '
+                'WHERE source_uuid = ? AND user_uuid = ? AND fields = ?',
+                (saved_at,) + self._encode_key(key),
+            )
+        return cursor.rowcount > 0
+
+    def delete_user(self, user_uuid):
+        with self._lock:
+            self._connection.execute('DELETE FROM google_contact_book WHERE user_uuid = ?', (user_uuid,))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    @staticmethod
+    def _encode_key(key):
+        source_uuid, user_uuid = key[:2]
+        fields = ','.join(key[2]) if len(key) > 2 else ''
+        return str(source_uuid), str(user_uuid), fields
@@ -0,0 +1,119 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+import threading
+import unittest
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from hamcrest import (
+    assert_that,
+    contains,
+    equal_to,
+    has_entries,
+)
+from mock import Mock, sentinel as s
+
+from .. import async_engine, services
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if not self.path.startswith('/contacts'):
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        body = json.dumps({'path': self.path, 'token': self.headers.get('X-Auth-Token')})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipIf(async_engine.aiohttp is None, 'aiohttp is not installed')
+class TestAsyncEngine(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), _Handler)
+        cls.url = 'http://127.0.0.1:{}'.format(cls.server.server_port)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.engine = async_engine.AsyncEngine(pool_size=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.stop()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_get_json(self):
+        status_code, body = self.engine.run(self.engine.get_json(
+            self.url + '/contacts', params={'start-index': 1},
+        ))
+
+        assert_that(status_code, equal_to(200))
+        assert_that(body, has_entries(path='/contacts?start-index=1'))
+
+    def test_get_json_error(self):
+        result = self.engine.run(self.engine.get_json(self.url + '/unknown'))
+
+        assert_that(result, contains(404, None))
+
+    def test_gather_json(self):
+        results = self.engine.run(self.engine.gather_json(
+            [self.url + '/contacts/1', self.url + '/contacts/2'],
+        ))
+
+        assert_that(results, contains(
+            contains(200, has_entries(path='/contacts/1')),
+            contains(200, has_entries(path='/contacts/2')),
+        ))
+
+    def test_get_external_auth(self):
+        status_code, body = self.engine.run(self.engine.get_external_auth(
+            'user-uuid',
+            'wazo-token',
+            host='127.0.0.1',
+            port=self.server.server_port,
+            https=False,
+            prefix='/contacts',
+        ))
+
+        assert_that(body, has_entries(
+            path='/contacts/0.1/users/user-uuid/external/google',
+            token='wazo-token',
+        ))
+
+
+class TestGoogleServiceWithEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.service = services.GoogleService()
+        self.service.session = Mock()
+        self.service.engine = Mock()
+        self.service.engine.run.side_effect = lambda result: result
+        self.service.stream = False
+
+    def test_contacts_fetched_with_engine(self):
+        self.service.engine.get_json.return_value = (200, {'feed': {'entry': [{'title': {'$t': 'Mario'}}]}})
+
+        contacts, total = self.service.get_contacts(s.token)
+
+        assert_that(contacts, contains(has_entries(name='Mario')))
+        self.service.session.get.assert_not_called()
+
+    def test_contacts_by_ids_fetched_with_engine(self):
+        self.service.engine.gather_json.return_value = [
+            (200, {'entry': {'id': {'$t': 'http://google.com/1'}}}),
+            (404, None),
+        ]
+
+        contacts = self.service.get_contacts_by_ids(s.token, ['1', '2'])
+
+        assert_that(contacts, contains(has_entries(id='1')))
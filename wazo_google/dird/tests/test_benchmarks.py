@@ -0,0 +1,54 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from hamcrest import (
+    assert_that,
+    contains_inanyorder,
+    equal_to,
+    has_entries,
+    has_length,
+    not_,
+    only_contains,
+)
+
+from ..benchmarks.__main__ import compare, operations, run
+from ..benchmarks.feed import FeedGenerator
+
+
+class TestFeedGenerator(unittest.TestCase):
+
+    def test_entries_are_deterministic(self):
+        entries = FeedGenerator(seed=42).entries(50)
+
+        assert_that(entries, has_length(50))
+        assert_that(FeedGenerator(seed=42).entries(50), equal_to(entries))
+        assert_that(FeedGenerator(seed=7).entries(50), not_(equal_to(entries)))
+
+    def test_feed_pages(self):
+        feed = FeedGenerator().feed(30, page_size=10)['feed']
+
+        assert_that(feed['entry'], has_length(10))
+        assert_that(feed['link'], equal_to([{'rel': 'next', 'href': 'next'}]))
+        assert_that(feed['openSearch$totalResults'], equal_to({'$t': '30'}))
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_run(self):
+        report = run(sizes=[10], repeat=1)
+
+        assert_that(
+            [result['operation'] for result in report['results']],
+            contains_inanyorder(*operations),
+        )
+        assert_that(report['results'], only_contains(has_entries(contacts=10)))
+
+    def test_compare(self):
+        report = {'results': [{'operation': 'sort', 'contacts': 10, 'median_ms': 3, 'peak_bytes': 20}]}
+        baseline = {'results': [{'operation': 'sort', 'contacts': 10, 'median_ms': 2, 'peak_bytes': 10}]}
+
+        compare(report, baseline)
+
+        assert_that(report['results'][0], has_entries(median_ratio=1.5, peak_ratio=2))
@@ -0,0 +1,37 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import time
+import unittest
+
+from hamcrest import (
+    assert_that,
+    equal_to,
+)
+from mock import Mock, sentinel as s
+
+from ..bus import BusConsumer
+
+
+class TestBusConsumer(unittest.TestCase):
+
+    def test_stop_while_the_bus_is_unreachable(self):
+        consumer = BusConsumer(host='127.0.0.1', port=1)
+        consumer.start()
+        time.sleep(0.1)
+
+        consumer.stop()
+
+        assert_that(consumer._thread.is_alive(), equal_to(False))
+
+    def test_callbacks_of_the_event(self):
+        consumer = BusConsumer()
+        callback = Mock()
+        consumer.subscribe('user_created', 'users.*.created', callback)
+        message = Mock()
+
+        consumer._on_message({'name': 'user_created', 'data': {'uuid': s.uuid}}, message)
+        consumer._on_message({'name': 'user_deleted', 'data': {'uuid': s.uuid}}, message)
+
+        callback.assert_called_once_with({'uuid': s.uuid})
+        assert_that(message.ack.call_count, equal_to(2))
@@ -2,16 +2,22 @@
 # SPDX-License-Identifier: GPL-3.0+
 
 from unittest import TestCase
+from mock import Mock, patch, sentinel as s
 
 from hamcrest import (
     assert_that,
     calling,
+    contains,
+    contains_inanyorder,
     equal_to,
+    has_entries,
+    has_property,
     not_,
     raises,
 )
 
 from ..plugin import GooglePlugin
+from ..services import ContactBook
 
 
 class TestGooglePlugin(TestCase):
@@ -72,3 +78,67 @@ class TestGooglePlugin(TestCase):
         assert_that(self.source._first_match_predicate(term, luigi), equal_to(True))
         assert_that(self.source._first_match_predicate(term, peach), equal_to(True))
         assert_that(self.source._first_match_predicate(term[:-1], peach), equal_to(False))
+
+    @patch('wazo_google.dird.plugin.services.get_google_access_token', Mock())
+    def test_search_without_contact_book_ignores_accents(self):
+        dependencies = dict(self.DEPENDENCIES)
+        dependencies['config'] = dict(self.DEPENDENCIES['config'], searched_columns=['name'])
+        self.source.load(dependencies)
+        self.source.google = Mock()
+        self.source.google.get_contact_book.return_value = None
+        self.source.google.get_contacts_with_term.return_value = [
+            {'id': '1', 'name': 'Hélène', 'numbers': []},
+            {'id': '2', 'name': 'Mario Bros', 'numbers': []},
+        ]
+
+        results = self.source.search('HELENE', {'xivo_user_uuid': s.user_uuid, 'token': s.token})
+
+        assert_that(results, contains(has_property('fields', has_entries(name='Hélène'))))
+
+    def test_google_fields_from_used_columns(self):
+        self.source.load(self.DEPENDENCIES)
+
+        assert_that(self.source.google.entry_fields, contains_inanyorder(
+            'id', 'gd:deleted', 'title', 'gd:phoneNumber',
+        ))
+
+    @patch('wazo_google.dird.plugin.services.get_google_access_token', Mock())
+    def test_first_match_from_contact_book(self):
+        self.source.load(self.DEPENDENCIES)
+        self.source.google = Mock()
+        self.source.google.get_contact_book.return_value = ContactBook([
+            {'id': '1', 'name': 'Mario Bros', 'numbers': ['5555551234']},
+            {'id': '2', 'name': 'Luigi Bros', 'numbers': ['5555554567']},
+        ])
+
+        result = self.source.first_match('5555554567', {'xivo_user_uuid': s.user_uuid, 'token': s.token})
+
+        assert_that(result.fields, has_entries(name='Luigi Bros'))
+        self.source.google.get_contacts_with_term.assert_not_called()
+
+    @patch('wazo_google.dird.plugin.services.get_google_access_token', Mock())
+    def test_first_match_canonical_number(self):
+        dependencies = dict(self.DEPENDENCIES)
+        dependencies['config'] = dict(
+            self.DEPENDENCIES['config'],
+            first_matched_columns=['normalized_numbers'],
+            number_normalization={'country_code': '33'},
+        )
+        self.source.load(dependencies)
+        contact = self.source.google.formatter.format({
+            'id': {'$t': 'http://www.google.com/m8/feeds/contacts/me/base/1'},
+            'title': {'$t': 'Mario Bros'},
+            'gd$phoneNumber': [{'rel': 'http://schemas.google.com/g/2005#home', '$t': '01 23 45 67 89'}],
+        })
+        self.source.google = Mock(normalizer=self.source.google.normalizer)
+        self.source.google.get_contact_book.return_value = ContactBook([contact])
+
+        result = self.source.first_match('+33123456789', {'xivo_user_uuid': s.user_uuid, 'token': s.token})
+
+        assert_that(result.fields, has_entries(name='Mario Bros'))
+
+    def test_first_match_terms_of_names_and_emails(self):
+        self.source.load(self.DEPENDENCIES)
+
+        assert_that(self.source._first_match_terms('Mario Bros'), contains('mario bros'))
+        assert_that(self.source._first_match_terms('john.doe@x.com'), contains('john.doe@x.com'))
@@ -2,9 +2,9 @@
 # SPDX-License-Identifier: GPL-3.0+
 
 from unittest import TestCase
-from mock import Mock, ANY
+from mock import Mock, ANY, patch
 
-from ..http import GoogleList, GoogleItem
+from ..http import GoogleList, GoogleItem, GoogleMetrics, GoogleWarmup
 from ..view import GoogleView
 
 
@@ -13,6 +13,7 @@ class TestGoogleView(TestCase):
     def setUp(self):
         self.plugin = GoogleView()
         self.api = Mock()
+        self.addCleanup(self.plugin.unload)
 
     def test_when_load_then_routes_added(self):
         dependencies = {
@@ -34,3 +35,43 @@ class TestGoogleView(TestCase):
         self.api.add_resource.assert_any_call(
             GoogleItem, ANY, resource_class_args=ANY,
         )
+        self.api.add_resource.assert_any_call(GoogleMetrics, '/backends/google/metrics')
+        self.api.add_resource.assert_any_call(
+            GoogleWarmup, '/backends/google/warmup', resource_class_args=(self.plugin.prewarmer,),
+        )
+
+    @patch('wazo_google.dird.view.services.delete_user_books')
+    @patch('wazo_google.dird.view.services.token_cache')
+    def test_caches_invalidated_when_google_account_changes(self, token_cache, delete_user_books):
+        self.plugin._on_external_auth_event({'user_uuid': 'user-uuid', 'external_auth_name': 'google'})
+        self.plugin._on_external_auth_event({'user_uuid': 'user-uuid', 'external_auth_name': 'microsoft'})
+
+        token_cache.invalidate_user.assert_called_once_with('user-uuid')
+        delete_user_books.assert_called_once_with('user-uuid')
+
+    @patch('wazo_google.dird.view.services.delete_user_books', Mock())
+    @patch('wazo_google.dird.view.services.token_cache', Mock())
+    def test_contacts_loaded_when_google_account_linked(self):
+        self.plugin.prewarmer = Mock()
+
+        self.plugin._on_external_auth_added({'user_uuid': 'user-uuid', 'external_auth_name': 'google'})
+        self.plugin._on_external_auth_added({'user_uuid': 'user-uuid', 'external_auth_name': 'microsoft'})
+
+        self.plugin.prewarmer.warm_user.assert_called_once_with('user-uuid')
+
+    def test_contacts_loaded_when_user_logs_in(self):
+        self.plugin.prewarmer = Mock()
+
+        self.plugin._on_session_created({'uuid': 'session', 'tenant_uuid': 'tenant', 'user_uuid': 'user-uuid'})
+        self.plugin._on_session_created({'uuid': 'session', 'tenant_uuid': 'tenant', 'user_uuid': None})
+
+        self.plugin.prewarmer.warm_user.assert_called_once_with('user-uuid', 'tenant')
+
+    def test_unload_stops_the_threads(self):
+        self.plugin.prewarmer = Mock()
+        self.plugin.bus_consumer = Mock()
+
+        self.plugin.unload()
+
+        self.plugin.prewarmer.stop.assert_called_once_with()
+        self.plugin.bus_consumer.stop.assert_called_once_with()
@@ -0,0 +1,57 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from flask import Flask
+from hamcrest import (
+    assert_that,
+    contains,
+    equal_to,
+    has_entries,
+)
+from mock import Mock, patch, sentinel as s
+
+from .. import services
+from ..http import GoogleContactList
+
+SOURCE = {
+    'uuid': 'source-uuid',
+    'auth': {'host': 'localhost', 'port': 9497},
+    'cache': {'ttl': 0},
+    'http': {'stream': False},
+}
+
+
+@patch('wazo_google.dird.http.get_google_access_token', Mock(return_value=s.google_token))
+@patch('wazo_google.dird.http.Tenant', Mock(autodetect=Mock(return_value=Mock(uuid='tenant-uuid'))))
+@patch('wazo_google.dird.http.token', Mock(user_uuid='user-uuid'))
+class TestGoogleContactList(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        source_service = Mock()
+        source_service.get.return_value = SOURCE
+        self.resource = GoogleContactList({}, {}, source_service)
+
+    def get(self, query_string):
+        with patch.object(services.GoogleService, '_get', return_value={
+            'entry': [{'title': {'$t': name}} for name in ('Mario', 'Peach', 'Bowser', 'Luigi')],
+        }):
+            with self.app.test_request_context('/', query_string=query_string):
+                return self.resource.get('source-uuid')
+
+    def test_contacts_sorted_by_name_by_default(self):
+        body, status_code = self.get({'limit': 2, 'offset': 1})
+
+        assert_that(status_code, equal_to(200))
+        assert_that(body, has_entries(
+            total=4,
+            filtered=4,
+            items=contains(has_entries(name='Luigi'), has_entries(name='Mario')),
+        ))
+
+    def test_contacts_sorted_in_descending_order(self):
+        body, _ = self.get({'order': 'name', 'direction': 'desc', 'limit': 1})
+
+        assert_that(body['items'], contains(has_entries(name='Peach')))
@@ -0,0 +1,97 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import time
+import unittest
+
+from hamcrest import (
+    assert_that,
+    contains_string,
+    equal_to,
+)
+from mock import Mock, sentinel as s
+
+from .. import metrics, services
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry('test_')
+        self.counter = self.registry.counter('requests_total', 'Requests', labels=('status',))
+        self.histogram = self.registry.histogram('duration_seconds', 'Duration', buckets=(1, 5))
+
+    def test_counter(self):
+        self.counter.inc(status=200)
+        self.counter.inc(2, status=200)
+        self.counter.inc(status=404)
+
+        assert_that(self.counter.value(status=200), equal_to(3))
+        assert_that(self.counter.value(status=500), equal_to(0))
+
+    def test_histogram(self):
+        self.histogram.observe(0.5)
+        self.histogram.observe(3)
+        self.histogram.observe(10)
+
+        assert_that(self.histogram.count(), equal_to(3))
+        assert_that(self.histogram.sum(), equal_to(13.5))
+
+    def test_render(self):
+        self.counter.inc(status=200)
+        self.histogram.observe(3)
+
+        text = self.registry.render()
+
+        assert_that(text, contains_string('# TYPE test_requests_total counter\n'))
+        assert_that(text, contains_string('test_requests_total{status="200"} 1\n'))
+        assert_that(text, contains_string('test_duration_seconds_bucket{le="1"} 0\n'))
+        assert_that(text, contains_string('test_duration_seconds_bucket{le="5"} 1\n'))
+        assert_that(text, contains_string('test_duration_seconds_bucket{le="+Inf"} 1\n'))
+        assert_that(text, contains_string('test_duration_seconds_count 1\n'))
+
+    def test_instrumented(self):
+        @metrics.instrumented('test')
+        def operation():
+            return [s.contact, s.contact]
+
+        metrics.registry.reset()
+        operation()
+
+        assert_that(metrics.operation_duration.count(operation='test'), equal_to(1))
+        assert_that(metrics.operation_results.sum(operation='test'), equal_to(2))
+
+
+class TestServiceMetrics(unittest.TestCase):
+
+    def setUp(self):
+        metrics.registry.reset()
+        services.token_cache.clear()
+        self.service = services.GoogleService({'http': {'stream': False}})
+        self.service.session = Mock()
+
+    def tearDown(self):
+        services.token_cache.clear()
+
+    def test_google_responses(self):
+        self.service.session.get.side_effect = [
+            Mock(status_code=200, content=b'12345', json=Mock(return_value={'feed': {'entry': [{}, {}]}})),
+            Mock(status_code=401),
+        ]
+
+        self.service.get_contacts(s.token)
+        self.service.get_contacts(s.token)
+
+        assert_that(metrics.google_responses.value(endpoint='contacts', status=200), equal_to(1))
+        assert_that(metrics.google_responses.value(endpoint='contacts', status=401), equal_to(1))
+        assert_that(metrics.google_received_bytes.value(endpoint='contacts'), equal_to(5))
+        assert_that(metrics.google_received_contacts.value(), equal_to(2))
+        assert_that(metrics.google_request_duration.count(endpoint='contacts'), equal_to(2))
+
+    def test_token_cache(self):
+        services.token_cache.set(('localhost:9497', s.user_uuid), s.access_token, time.time() + 3600)
+
+        services.get_google_access_token(s.user_uuid, s.wazo_token, host='localhost', port=9497)
+
+        assert_that(metrics.cache_requests.value(cache='token', result='hit'), equal_to(1))
+        assert_that(metrics.auth_request_duration.count(), equal_to(0))
@@ -0,0 +1,149 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import threading
+import time
+import unittest
+
+from hamcrest import (
+    assert_that,
+    contains_inanyorder,
+    equal_to,
+)
+from mock import Mock, patch, sentinel as s
+
+from .. import metrics
+from ..exceptions import GoogleTokenNotFoundException
+from ..prewarm import Prewarmer, ServiceToken
+
+SOURCE = {
+    'uuid': 'source-uuid',
+    'auth': {'host': 'localhost', 'port': 9497},
+    'first_matched_columns': ['numbers'],
+}
+
+
+class TestServiceToken(unittest.TestCase):
+
+    @patch('wazo_google.dird.prewarm.Auth')
+    def test_token_reused_until_renewal(self, Auth):
+        Auth.return_value.token.new.return_value = {'token': 'service-token'}
+        service_token = ServiceToken({'username': 'dird', 'password': 'secret'})
+
+        assert_that(service_token.get(), equal_to('service-token'))
+        assert_that(service_token.get(), equal_to('service-token'))
+
+        Auth.assert_called_once_with(username='dird', password='secret')
+        Auth.return_value.token.new.assert_called_once_with(expiration=3600)
+
+        service_token._renew_at = 0
+        service_token.get()
+
+        assert_that(Auth.return_value.token.new.call_count, equal_to(2))
+
+
+@patch('wazo_google.dird.prewarm.services.get_google_access_token', Mock(return_value=s.google_token))
+@patch('wazo_google.dird.prewarm.services.GoogleService')
+class TestPrewarmer(unittest.TestCase):
+
+    def setUp(self):
+        metrics.registry.reset()
+        self.source_service = Mock()
+        self.source_service.list_.return_value = [SOURCE]
+        self.prewarmer = Prewarmer({}, self.source_service, max_workers=2)
+        self.prewarmer._service_token = Mock()
+
+    def tearDown(self):
+        self.prewarmer.stop()
+
+    def test_warm_user(self, GoogleService):
+        GoogleService.return_value.get_contact_book.return_value = []
+
+        self.prewarmer.warm_user('user-uuid', 'tenant-uuid')
+        self.prewarmer.stop()
+
+        self.source_service.list_.assert_called_once_with('google', ['tenant-uuid'])
+        GoogleService.assert_called_once_with(SOURCE, {'id', 'name', 'numbers'})
+        GoogleService.return_value.get_contact_book.assert_called_once_with(s.google_token, 'user-uuid')
+        assert_that(metrics.prewarms.value(result='warmed'), equal_to(1))
+
+    def test_tenant_of_the_user_fetched_when_unknown(self, GoogleService):
+        client = self.prewarmer._service_token.client.return_value
+        client.users.get.return_value = {'uuid': 'user-uuid', 'tenant_uuid': 'tenant-uuid'}
+
+        self.prewarmer.warm_user('user-uuid')
+        self.prewarmer.stop()
+
+        client.users.get.assert_called_once_with('user-uuid')
+        self.source_service.list_.assert_called_once_with('google', ['tenant-uuid'])
+
+    def test_users_without_google_account_are_skipped(self, GoogleService):
+        with patch('wazo_google.dird.prewarm.services.get_google_access_token',
+                   side_effect=GoogleTokenNotFoundException('user-uuid')):
+            self.prewarmer.warm_user('user-uuid', 'tenant-uuid')
+            self.prewarmer.stop()
+
+        GoogleService.return_value.get_contact_book.assert_not_called()
+        assert_that(metrics.prewarms.value(result='not_linked'), equal_to(1))
+
+    def test_pending_users_are_not_queued_twice(self, GoogleService):
+        started, release = threading.Event(), threading.Event()
+
+        def get_contact_book(google_token, user_uuid):
+            started.set()
+            release.wait(5)
+            return []
+
+        GoogleService.return_value.get_contact_book.side_effect = get_contact_book
+
+        assert_that(self.prewarmer.warm_user('user-uuid', 'tenant-uuid'), equal_to(True))
+        started.wait(5)
+        assert_that(self.prewarmer.warm_user('user-uuid', 'tenant-uuid'), equal_to(False))
+        release.set()
+        self.prewarmer.stop()
+
+        assert_that(GoogleService.return_value.get_contact_book.call_count, equal_to(1))
+
+    def test_failures_do_not_stop_the_warmup(self, GoogleService):
+        GoogleService.return_value.get_contact_book.side_effect = [Exception('boom'), []]
+
+        self.prewarmer.warm_user('user-1', 'tenant-uuid')
+        self.prewarmer.warm_user('user-2', 'tenant-uuid')
+        self.prewarmer.stop()
+
+        assert_that(metrics.prewarms.value(result='failure'), equal_to(1))
+        assert_that(metrics.prewarms.value(result='warmed'), equal_to(1))
+
+    def test_warm_tenant(self, GoogleService):
+        client = self.prewarmer._service_token.client.return_value
+        client.users.list.return_value = {'items': [{'uuid': 'user-1'}, {'uuid': 'user-2'}]}
+        get_contact_book = GoogleService.return_value.get_contact_book
+        get_contact_book.return_value = []
+
+        self.prewarmer.warm_tenant('tenant-uuid')
+        _wait_until(lambda: get_contact_book.call_count == 2)
+
+        client.users.list.assert_called_once_with(tenant_uuid='tenant-uuid', recurse=False)
+        warmed = [call[0][1] for call in get_contact_book.call_args_list]
+        assert_that(warmed, contains_inanyorder('user-1', 'user-2'))
+
+    def test_warm_tenant_when_wazo_auth_is_down(self, GoogleService):
+        client = self.prewarmer._service_token.client.return_value
+        client.users.list.side_effect = Exception('unreachable')
+
+        self.prewarmer.warm_tenant('tenant-uuid')
+        self.prewarmer.stop()
+
+        assert_that(metrics.prewarms.value(result='failure'), equal_to(1))
+
+    def test_no_warmup_once_stopped(self, GoogleService):
+        self.prewarmer.stop()
+
+        assert_that(self.prewarmer.warm_user('user-uuid', 'tenant-uuid'), equal_to(False))
+
+
+def _wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert_that(time.monotonic() < deadline, equal_to(True))
+        time.sleep(0.001)
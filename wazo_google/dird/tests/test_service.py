@@ -1,16 +1,896 @@
 # Copyright 2019 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import json
+import threading
+import time
 import unittest
 
+import requests
+
 from hamcrest import (
     assert_that,
+    calling,
     contains,
     contains_inanyorder,
+    contains_string,
+    equal_to,
     has_entries,
+    has_length,
+    has_property,
+    less_than,
+    none,
+    not_,
+    raises,
+    same_instance,
 )
+from mock import ANY, MagicMock, Mock, patch, sentinel as s
+
+from .. import metrics, services
+from ..exceptions import GoogleTokenNotFoundException
+
+
+class TestSessions(unittest.TestCase):
+
+    def test_get_session_reuses_sessions(self):
+        session = services.get_session('google.com', pool_size=4)
+
+        assert_that(services.get_session('google.com', pool_size=4), equal_to(session))
+        assert_that(services.get_session('google.com', pool_size=5), not_(equal_to(session)))
+        assert_that(session.get_adapter('https://google.com'), equal_to(
+            services.get_adapter('google.com', pool_size=4)
+        ))
+
+    def test_google_service_uses_configured_pool(self):
+        service = services.GoogleService({'http': {'pool_size': 4}})
+
+        assert_that(service.session, equal_to(services.get_session('google.com', pool_size=4)))
+
+
+class TestTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = services.TokenCache()
+
+    @patch('wazo_google.dird.services.time')
+    def test_get_until_shortly_before_expiration(self, time):
+        time.time.return_value = 1000
+        self.cache.set(s.key, s.access_token, 1100)
+
+        assert_that(self.cache.get(s.key), equal_to(s.access_token))
+
+        time.time.return_value = 1040
+        assert_that(self.cache.get(s.key), none())
+
+    def test_set_without_expiration(self):
+        self.cache.set(s.key, s.access_token, None)
+
+        assert_that(self.cache.get(s.key), none())
+
+    def test_invalidate(self):
+        self.cache.set(s.key, s.access_token, 2 ** 40)
+
+        self.cache.invalidate(s.access_token)
+
+        assert_that(self.cache.get(s.key), none())
+
+    def test_missing_until_ttl(self):
+        self.cache.set_missing(s.key, 0.01)
+
+        assert_that(self.cache.is_missing(s.key), equal_to(True))
+        time.sleep(0.02)
+        assert_that(self.cache.is_missing(s.key), equal_to(False))
+
+    def test_invalidate_user(self):
+        self.cache.set((s.host, s.user_uuid), s.access_token, 2 ** 40)
+        self.cache.set_missing((s.other_host, s.user_uuid), 60)
+        self.cache.set((s.host, s.other_user_uuid), s.other_access_token, 2 ** 40)
+
+        self.cache.invalidate_user(s.user_uuid)
+
+        assert_that(self.cache.get((s.host, s.user_uuid)), none())
+        assert_that(self.cache.is_missing((s.other_host, s.user_uuid)), equal_to(False))
+        assert_that(self.cache.get((s.host, s.other_user_uuid)), equal_to(s.other_access_token))
+
+
+class TestGetGoogleAccessToken(unittest.TestCase):
+
+    def setUp(self):
+        services.token_cache.clear()
+
+    def tearDown(self):
+        services.token_cache.clear()
+
+    @patch('wazo_google.dird.services._PooledAuth')
+    def test_token_is_cached(self, Auth):
+        Auth.return_value.external.get.return_value = {
+            'access_token': s.access_token,
+            'token_expiration': 2 ** 40,
+        }
+
+        services.get_google_access_token(s.user_uuid, s.wazo_token, host='localhost', port=9497)
+        result = services.get_google_access_token(s.user_uuid, s.wazo_token, host='localhost', port=9497)
+
+        assert_that(result, equal_to(s.access_token))
+        Auth.return_value.external.get.assert_called_once_with('google', s.user_uuid)
+
+    @patch('wazo_google.dird.services._PooledAuth')
+    def test_token_is_invalidated_when_rejected_by_google(self, Auth):
+        Auth.return_value.external.get.return_value = {
+            'access_token': s.access_token,
+            'token_expiration': 2 ** 40,
+        }
+        service = services.GoogleService({'http': {'stream': False}})
+        service.session = Mock()
+        service.session.get.return_value.status_code = 401
+
+        token = services.get_google_access_token(s.user_uuid, s.wazo_token, host='localhost', port=9497)
+        service.get_contacts(token)
+        services.get_google_access_token(s.user_uuid, s.wazo_token, host='localhost', port=9497)
+
+        assert_that(Auth.return_value.external.get.call_count, equal_to(2))
+
+    @patch('wazo_google.dird.services._PooledAuth')
+    def test_user_without_google_account_is_cached(self, Auth):
+        Auth.return_value.external.get.side_effect = requests.HTTPError(response=Mock(status_code=404))
+
+        for _ in range(2):
+            assert_that(
+                calling(services.get_google_access_token).with_args(
+                    s.user_uuid, s.wazo_token, host='localhost', port=9497,
+                ),
+                raises(GoogleTokenNotFoundException),
+            )
+
+        Auth.return_value.external.get.assert_called_once_with('google', s.user_uuid)
+
+        services.token_cache.invalidate_user(s.user_uuid)
+        Auth.return_value.external.get.side_effect = None
+        Auth.return_value.external.get.return_value = {
+            'access_token': s.access_token,
+            'token_expiration': 2 ** 40,
+        }
+
+        result = services.get_google_access_token(s.user_uuid, s.wazo_token, host='localhost', port=9497)
+
+        assert_that(result, equal_to(s.access_token))
+
+    @patch('wazo_google.dird.services._PooledAuth')
+    def test_other_errors_are_not_cached(self, Auth):
+        Auth.return_value.external.get.side_effect = requests.HTTPError(response=Mock(status_code=401))
+
+        for _ in range(2):
+            assert_that(
+                calling(services.get_google_access_token).with_args(
+                    s.user_uuid, s.wazo_token, host='localhost', port=9497,
+                ),
+                raises(GoogleTokenNotFoundException),
+            )
+
+        assert_that(Auth.return_value.external.get.call_count, equal_to(2))
+
+
+class TestContactCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = services.ContactCache(max_entries=2, max_contacts=5)
+
+    def test_lru_eviction(self):
+        first, second, third = self._book(1), self._book(1), self._book(1)
+        self.cache.set(s.first, first)
+        self.cache.set(s.second, second)
+        self.cache.get(s.first)
+
+        self.cache.set(s.third, third)
+
+        assert_that(self.cache.get(s.second), none())
+        assert_that(self.cache.get(s.first), equal_to(first))
+        assert_that(self.cache.get(s.third), equal_to(third))
+
+    def test_max_contacts_eviction(self):
+        first, second = self._book(3), self._book(3)
+        self.cache.set(s.first, first)
+        self.cache.set(s.second, second)
+
+        assert_that(self.cache.get(s.first), none())
+        assert_that(self.cache.get(s.second), equal_to(second))
+
+    def test_delete_user(self):
+        book = self._book(1)
+        self.cache.set((s.source, s.user), book)
+        self.cache.set((s.source, s.user, ('id',)), book)
+        self.cache.set((s.source, s.other), book)
+
+        self.cache.delete_user(s.user)
+
+        assert_that(self.cache.get((s.source, s.user)), none())
+        assert_that(self.cache.get((s.source, s.user, ('id',))), none())
+        assert_that(self.cache.get((s.source, s.other)), equal_to(book))
+
+    def test_books_fetched_before_the_user_deletion_are_discarded(self):
+        book = self._book(1)
+        generation = self.cache.generation(s.user)
+        self.cache.delete_user(s.user)
+
+        assert_that(self.cache.set((s.source, s.user), book, generation), equal_to(False))
+        assert_that(self.cache.get((s.source, s.user)), none())
+        assert_that(self.cache.set((s.source, s.user), book, self.cache.generation(s.user)), equal_to(True))
+
+    @staticmethod
+    def _book(nb_contacts):
+        return services.ContactBook([{'id': str(i)} for i in range(nb_contacts)])
+
+
+class TestContactBook(unittest.TestCase):
+
+    @patch('wazo_google.dird.services.time')
+    def test_is_expired(self, time):
+        time.monotonic.return_value = 100
+        book = services.ContactBook([])
+
+        time.monotonic.return_value = 110
+        assert_that(book.is_expired(10), equal_to(False))
+
+        time.monotonic.return_value = 111
+        assert_that(book.is_expired(10), equal_to(True))
+
+    def test_apply(self):
+        book = services.ContactBook(
+            [{'id': '1', 'name': 'Mario'}, {'id': '2', 'name': 'Luigi'}],
+            updated=s.updated,
+        )
+
+        book.apply([{'id': '2', 'name': 'Luigi Bros'}, {'id': '3', 'name': 'Peach'}], ['1'], s.new_updated)
+
+        assert_that(book.contacts, contains(
+            has_entries(id='2', name='Luigi Bros'),
+            has_entries(id='3', name='Peach'),
+        ))
+        assert_that(book.updated, equal_to(s.new_updated))
+
+
+class TestContactBookFirstMatch(unittest.TestCase):
+
+    def setUp(self):
+        self.mario = {'id': '1', 'name': 'Mario', 'numbers': ['5555551234']}
+        self.luigi = {'id': '2', 'name': 'Luigi', 'numbers': ['5555554567', '5555551111']}
+        self.book = services.ContactBook([self.mario, self.luigi])
+
+    def test_first_match(self):
+        assert_that(self.book.first_match(['numbers'], '5555551111'), equal_to(self.luigi))
+        assert_that(self.book.first_match(['numbers', 'name'], 'MARIO'), equal_to(self.mario))
+        assert_that(self.book.first_match(['numbers'], '555555111'), none())
+
+    def test_first_match_after_apply(self):
+        self.book.first_match(['numbers'], '5555551111')
+        peach = {'id': '3', 'name': 'Peach', 'numbers': ['5555551111']}
+        new_luigi = {'id': '2', 'name': 'Luigi', 'numbers': ['5555559999']}
+
+        self.book.apply([new_luigi, peach], ['1'], s.updated)
+
+        assert_that(self.book.first_match(['numbers'], '5555551111'), equal_to(peach))
+        assert_that(self.book.first_match(['numbers'], '5555559999'), equal_to(new_luigi))
+        assert_that(self.book.first_match(['numbers'], '5555554567'), none())
+        assert_that(self.book.first_match(['numbers'], '5555551234'), none())
+
+    def test_first_match_index_does_not_compare_contacts(self):
+        class Contact(dict):
+            def __eq__(self, other):
+                raise AssertionError('contacts compared')
+
+            __hash__ = None
+
+        mario = Contact(id='1', name='Bros', numbers=['5555551234', '5555551234'])
+        luigi = Contact(id='2', name='Bros', numbers=['5555551234'])
+        book = services.ContactBook([mario, luigi])
+
+        assert_that(book.first_match(['name', 'numbers'], 'bros'), same_instance(mario))
+
+        book.apply([], ['1'], s.updated)
+
+        assert_that(book.first_match(['name', 'numbers'], '5555551234'), same_instance(luigi))
+
+    def test_first_match_waits_for_the_synchronization(self):
+        self.book.first_match(['numbers'], '5555551111')
+        results = []
+
+        with self.book._lock:
+            thread = threading.Thread(
+                target=lambda: results.append(self.book.first_match(['numbers'], '5555551111')),
+            )
+            thread.start()
+            thread.join(0.05)
+            assert_that(results, has_length(0))
+        thread.join(5)
+
+        assert_that(results, contains(self.luigi))
+
+
+class TestContactBookSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.mario = {'id': '1', 'name': 'Mario Bros', 'emails': ['mario@example.com'], 'numbers': ['5555551234']}
+        self.luigi = {'id': '2', 'name': 'Luigi Bros', 'emails': [], 'numbers': ['5555554567']}
+        self.zelda = {'id': '3', 'name': 'Zélda', 'emails': [], 'numbers': []}
+        self.book = services.ContactBook([self.mario, self.luigi, self.zelda])
+
+    def test_search(self):
+        columns = ['name', 'emails', 'numbers']
+
+        assert_that(self.book.search(columns, 'bros'), contains(self.mario, self.luigi))
+        assert_that(self.book.search(columns, 'RIO@EX'), contains(self.mario))
+        assert_that(self.book.search(columns, '4567'), contains(self.luigi))
+        assert_that(self.book.search(columns, 'o'), contains(self.mario, self.luigi))
+        assert_that(self.book.search(columns, 'zelda'), contains(self.zelda))
+        assert_that(self.book.search(columns, 'brosx'), equal_to([]))
+
+    def test_search_only_searched_columns(self):
+        assert_that(self.book.search(['numbers'], 'bros'), equal_to([]))
+
+    def test_search_after_apply(self):
+        self.book.search(['name'], 'bros')
+        peach = {'id': '4', 'name': 'Peach Bros'}
+
+        self.book.apply([peach], ['1'], s.updated)
+
+        assert_that(self.book.search(['name'], 'bros'), contains(self.luigi, peach))
+
+
+class TestGoogleServiceCache(unittest.TestCase):
+
+    def setUp(self):
+        services.contact_cache.clear()
+        self.service = services.GoogleService({
+            'uuid': s.source_uuid,
+            'cache': {'ttl': 60, 'max_stale': 0},
+            'http': {'stream': False},
+        })
+        self.service._get = Mock(return_value={
+            'updated': {'$t': '2019-05-01T12:00:00.000Z'},
+            'entry': [
+                {'id': {'$t': 'http://www.google.com/m8/feeds/contacts/me/base/1'}, 'title': {'$t': 'Mario Bros'}},
+                {'id': {'$t': 'http://www.google.com/m8/feeds/contacts/me/base/2'}, 'title': {'$t': 'Luigi Bros'}},
+            ],
+        })
+
+    def tearDown(self):
+        services.contact_cache.clear()
+
+    def test_contacts_fetched_once(self):
+        self.service.get_contacts(s.token, s.user_uuid)
+        contacts, total = self.service.get_contacts(s.token, s.user_uuid)
+        results = list(self.service.get_contacts_with_term(s.token, 'mario', s.user_uuid))
+
+        assert_that(total, equal_to(2))
+        assert_that(results, contains(has_entries(name='Mario Bros')))
+        self.service._get.assert_called_once_with(s.token, validators=ANY, **{'start-index': 1})
+
+    def test_contacts_not_cached_without_a_user(self):
+        self.service.get_contacts(s.token)
+        self.service.get_contacts(s.token)
+
+        assert_that(self.service._get.call_count, equal_to(2))
+
+    def test_contacts_not_cached_when_disabled(self):
+        service = services.GoogleService({'uuid': s.source_uuid, 'cache': {'ttl': 0}, 'http': {'stream': False}})
+        service._get = self.service._get
+
+        service.get_contacts(s.token, s.user_uuid)
+        service.get_contacts(s.token, s.user_uuid)
+
+        assert_that(self.service._get.call_count, equal_to(2))
+
+    def test_expired_contacts_are_synchronized(self):
+        self.service.get_contacts(s.token, s.user_uuid)
+        services.contact_cache.get((s.source_uuid, s.user_uuid)).synced_at -= 61
+        self.service._get.return_value = {
+            'updated': {'$t': '2019-05-01T12:05:00.000Z'},
+            'entry': [
+                {'id': {'$t': 'http://www.google.com/m8/feeds/contacts/me/base/1'}, 'gd$deleted': {}},
+                {'id': {'$t': 'http://www.google.com/m8/feeds/contacts/me/base/3'}, 'title': {'$t': 'Peach'}},
+            ],
+        }
+
+        contacts, total = self.service.get_contacts(s.token, s.user_uuid)
+
+        self.service._get.assert_called_with(
+            s.token,
+            validators=ANY,
+            **{'updated-min': '2019-05-01T12:00:00.000Z', 'showdeleted': 'true', 'start-index': 1}
+        )
+        assert_that(contacts, contains(
+            has_entries(name='Luigi Bros'),
+            has_entries(name='Peach'),
+        ))
+
+    def test_failed_synchronization_fetches_all_contacts(self):
+        self.service.get_contacts(s.token, s.user_uuid)
+        services.contact_cache.get((s.source_uuid, s.user_uuid)).synced_at -= 61
+        feed = self.service._get.return_value
+        self.service._get.side_effect = [None, feed]
+
+        contacts, total = self.service.get_contacts(s.token, s.user_uuid)
+
+        self.service._get.assert_called_with(s.token, validators=ANY, **{'start-index': 1})
+        assert_that(total, equal_to(2))
+
+
+class TestGoogleServiceConditionalRequests(unittest.TestCase):
+
+    def setUp(self):
+        services.contact_cache.clear()
+        self.service = services.GoogleService({
+            'uuid': s.source_uuid,
+            'cache': {'ttl': 60, 'max_stale': 0, 'sync': False},
+            'http': {'stream': False},
+        })
+        self.service.session = Mock()
+        self.service.session.get.return_value = Mock(
+            status_code=200,
+            content=b'{}',
+            headers={'ETag': '"v1"', 'Last-Modified': 'Wed, 01 May 2019 12:00:00 GMT'},
+            json=Mock(return_value={'feed': {'entry': [{'title': {'$t': 'Mario'}}]}}),
+        )
+        self.service.get_contacts(s.token, s.user_uuid)
+        self.book = services.contact_cache.get((s.source_uuid, s.user_uuid))
+        self.book.synced_at -= 61
+
+    def tearDown(self):
+        services.contact_cache.clear()
+
+    def test_not_modified_contacts_are_reused(self):
+        self.service.session.get.return_value = Mock(status_code=304)
+
+        contacts, _ = self.service.get_contacts(s.token, s.user_uuid)
+
+        headers = self.service.session.get.call_args[1]['headers']
+        assert_that(headers, has_entries({
+            'If-None-Match': '"v1"',
+            'If-Modified-Since': 'Wed, 01 May 2019 12:00:00 GMT',
+        }))
+        assert_that(contacts, contains(has_entries(name='Mario')))
+        assert_that(services.contact_cache.get((s.source_uuid, s.user_uuid)), equal_to(self.book))
+        assert_that(self.book.is_expired(60), equal_to(False))
+
+    def test_modified_contacts_are_fetched(self):
+        self.service.session.get.return_value = Mock(
+            status_code=200,
+            content=b'{}',
+            headers={'ETag': '"v2"'},
+            json=Mock(return_value={'feed': {'entry': [{'title': {'$t': 'Luigi'}}]}}),
+        )
+
+        contacts, _ = self.service.get_contacts(s.token, s.user_uuid)
+
+        assert_that(contacts, contains(has_entries(name='Luigi')))
+        book = services.contact_cache.get((s.source_uuid, s.user_uuid))
+        assert_that(book.pages[0].validators, equal_to({'etag': '"v2"'}))
+
+    def test_not_modified_synchronization(self):
+        self.service.cache_sync = True
+        self.book.updated = '2019-05-01T12:00:00.000Z'
+        self.book.sync_validators = {'etag': '"sync"'}
+        self.service.session.get.return_value = Mock(status_code=304)
+
+        contacts, _ = self.service.get_contacts(s.token, s.user_uuid)
+
+        params = self.service.session.get.call_args[1]['params']
+        assert_that(params, has_entries({'updated-min': '2019-05-01T12:00:00.000Z'}))
+        assert_that(contacts, contains(has_entries(name='Mario')))
+        assert_that(self.book.is_expired(60), equal_to(False))
+
+
+class TestGoogleServiceFields(unittest.TestCase):
+
+    def test_all_fields_requested_by_default(self):
+        service = services.GoogleService()
 
-from ..import services
+        assert_that(service._fields, equal_to(
+            'entry(gd:deleted,gd:email,gd:phoneNumber,id,title),link,updated'
+        ))
+
+    def test_fields_of_used_columns(self):
+        service = services.GoogleService({'http': {'stream': False}}, columns=['id', 'name', 'unknown'])
+        service.session = Mock()
+        service.session.get.return_value = Mock(status_code=404)
+
+        service.get_contacts(s.token)
+
+        assert_that(service.session.get.call_args[1]['params'], has_entries(
+            fields='entry(gd:deleted,id,title),link,updated',
+        ))
+        assert_that(service.session.get.call_args[1]['headers'], has_entries({
+            'Accept-Encoding': 'gzip',
+            'User-Agent': contains_string('gzip'),
+        }))
+
+    def test_books_with_fewer_fields_are_not_shared(self):
+        services.contact_cache.clear()
+        self.addCleanup(services.contact_cache.clear)
+        full = services.GoogleService({'uuid': s.source_uuid, 'http': {'stream': False}})
+        partial = services.GoogleService({'uuid': s.source_uuid, 'http': {'stream': False}}, columns=['name'])
+        full._get = partial._get = Mock(return_value={'entry': [{'title': {'$t': 'Mario'}}]})
+
+        full.get_contacts(s.token, s.user_uuid)
+        partial.get_contacts(s.token, s.user_uuid)
+
+        assert_that(full._get.call_count, equal_to(2))
+
+    @patch('wazo_google.dird.services.in_flight_requests')
+    def test_streams_with_fewer_fields_are_not_shared(self, in_flight_requests):
+        config = {'uuid': s.source_uuid, 'cache': {'ttl': 0}}
+        full = services.GoogleService(config)
+        partial = services.GoogleService(config, columns=['name'])
+
+        full._fetch(s.token)
+        partial._fetch(s.token)
+
+        (full_key, _, _, _), (partial_key, _, _, _) = [
+            call[0] for call in in_flight_requests.iterate.call_args_list
+        ]
+        assert_that(full_key, not_(equal_to(partial_key)))
+
+
+class TestInFlightRequests(unittest.TestCase):
+
+    def setUp(self):
+        self.in_flight_requests = services.InFlightRequests()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = []
+
+    def fetch(self, term):
+        self.calls.append(term)
+        self.started.set()
+        self.release.wait(5)
+        yield from ['mario', 'luigi', 'peach']
+
+    def test_concurrent_iterations_share_the_fetch(self):
+        results = []
+
+        def iterate():
+            results.append(list(self.in_flight_requests.iterate(s.key, self.fetch, s.term)))
+
+        threads = [threading.Thread(target=iterate) for _ in range(3)]
+        threads[0].start()
+        self.started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        while self.in_flight_requests._requests[s.key][1] < 3:
+            time.sleep(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+
+        assert_that(self.calls, contains(s.term))
+        assert_that(results, contains(*[contains('mario', 'luigi', 'peach')] * 3))
+        assert_that(self.in_flight_requests, has_length(0))
+
+    def test_early_stop_does_not_end_the_other_iterations(self):
+        first = self.in_flight_requests.iterate(s.key, self.fetch, s.term)
+        second = self.in_flight_requests.iterate(s.key, self.fetch, s.term)
+        first_items, second_items = [], []
+        first_thread = threading.Thread(target=lambda: first_items.append(next(first)))
+        second_thread = threading.Thread(target=lambda: second_items.extend(second))
+        first_thread.start()
+        self.started.wait(5)
+        second_thread.start()
+        while self.in_flight_requests._requests[s.key][1] < 2:
+            time.sleep(0.001)
+        self.release.set()
+        first_thread.join()
+        first.close()
+        second_thread.join()
+
+        assert_that(first_items, contains('mario'))
+        assert_that(second_items, contains('mario', 'luigi', 'peach'))
+        assert_that(self.calls, contains(s.term))
+
+    def test_read_items_are_not_kept(self):
+        self.release.set()
+        iteration = self.in_flight_requests.iterate(s.key, self.fetch, s.term)
+
+        next(iteration)
+        next(iteration)
+
+        shared_iterator = self.in_flight_requests._requests[s.key][0]
+        assert_that(shared_iterator._items, has_length(0))
+        iteration.close()
+
+    def test_late_iterations_fetch_again_once_items_are_dropped(self):
+        self.release.set()
+        first = self.in_flight_requests.iterate(s.key, self.fetch, s.term)
+        next(first)
+
+        second = list(self.in_flight_requests.iterate(s.key, self.fetch, s.term))
+
+        assert_that(second, contains('mario', 'luigi', 'peach'))
+        assert_that(list(first), contains('luigi', 'peach'))
+        assert_that(self.calls, contains(s.term, s.term))
+        assert_that(self.in_flight_requests, has_length(0))
+
+    def test_finished_requests_are_not_shared(self):
+        self.release.set()
+
+        list(self.in_flight_requests.iterate(s.key, self.fetch, s.term))
+        list(self.in_flight_requests.iterate(s.key, self.fetch, s.term))
+
+        assert_that(self.calls, contains(s.term, s.term))
+
+    def test_call_error_is_raised(self):
+        function = Mock(side_effect=Exception(s.error))
+
+        assert_that(
+            calling(self.in_flight_requests.call).with_args(s.key, function),
+            raises(Exception),
+        )
+
+
+class TestGoogleServiceStaleWhileRevalidate(unittest.TestCase):
+
+    def setUp(self):
+        services.contact_cache.clear()
+        metrics.registry.reset()
+        self.service = services.GoogleService({'uuid': s.source_uuid, 'cache': {'ttl': 60, 'max_stale': 600}})
+        self.service._get = Mock(return_value={
+            'entry': [{'id': {'$t': 'http://www.google.com/m8/feeds/contacts/me/base/1'}, 'title': {'$t': 'Mario'}}],
+        })
+        self.service.get_contacts(s.token, s.user_uuid)
+        self.book = services.contact_cache.get((s.source_uuid, s.user_uuid))
+        self.service._get.reset_mock()
+        self.service._get.return_value = {
+            'entry': [{'id': {'$t': 'http://www.google.com/m8/feeds/contacts/me/base/2'}, 'title': {'$t': 'Luigi'}}],
+        }
+
+    def tearDown(self):
+        services.contact_cache.clear()
+        services._refreshing.clear()
+
+    @patch('wazo_google.dird.services._refresh_executor')
+    def test_stale_contacts_are_served_while_refreshed(self, executor):
+        self.book.synced_at -= 120
+
+        contacts, _ = self.service.get_contacts(s.token, s.user_uuid)
+        self.service.get_contacts(s.token, s.user_uuid)
+
+        assert_that(contacts, contains(has_entries(name='Mario')))
+        self.service._get.assert_not_called()
+        executor.submit.assert_called_once_with(
+            self.service._background_refresh, s.token, (s.source_uuid, s.user_uuid), self.book,
+        )
+
+        self.service._background_refresh(s.token, (s.source_uuid, s.user_uuid), self.book)
+
+        contacts, _ = self.service.get_contacts(s.token, s.user_uuid)
+        assert_that(contacts, contains(has_entries(name='Luigi')))
+        assert_that(metrics.cache_refreshes.value(result='success'), equal_to(1))
+
+    @patch('wazo_google.dird.services._refresh_executor')
+    def test_failed_refresh_keeps_the_stale_contacts(self, executor):
+        self.book.synced_at -= 120
+        self.service._get.return_value = None
+
+        self.service._background_refresh(s.token, (s.source_uuid, s.user_uuid), self.book)
+        contacts, _ = self.service.get_contacts(s.token, s.user_uuid)
+
+        assert_that(contacts, contains(has_entries(name='Mario')))
+        assert_that(metrics.cache_refreshes.value(result='failure'), equal_to(1))
+
+    @patch('wazo_google.dird.services._refresh_executor')
+    def test_contacts_older_than_max_stale_are_fetched(self, executor):
+        self.book.synced_at -= 700
+
+        contacts, _ = self.service.get_contacts(s.token, s.user_uuid)
+
+        assert_that(contacts, contains(has_entries(name='Luigi')))
+        executor.submit.assert_not_called()
+
+
+class TestGoogleServiceContactsByIds(unittest.TestCase):
+
+    def setUp(self):
+        services.contact_cache.clear()
+        self.service = services.GoogleService({'uuid': s.source_uuid})
+        self.service._get = Mock()
+        self.service._request = Mock(side_effect=lambda token, url, params: {
+            'entry': {'id': {'$t': url}, 'title': {'$t': 'Contact'}},
+        })
+
+    def tearDown(self):
+        services.contact_cache.clear()
+
+    def test_contacts_fetched_by_id(self):
+        contacts = self.service.get_contacts_by_ids(s.token, ['1', '2', '1'], s.user_uuid)
+
+        assert_that(contacts, contains(has_entries(id='1'), has_entries(id='2')))
+        assert_that(self.service._request.call_count, equal_to(2))
+        self.service._get.assert_not_called()
+
+    def test_missing_contacts_are_ignored(self):
+        self.service._request.side_effect = [None]
+
+        contacts = self.service.get_contacts_by_ids(s.token, ['1'], s.user_uuid)
+
+        assert_that(contacts, equal_to([]))
+
+    def test_cached_contacts(self):
+        book = services.ContactBook([{'id': '1'}, {'id': '2'}, {'id': '3'}])
+        services.contact_cache.set((s.source_uuid, s.user_uuid), book)
+
+        contacts = self.service.get_contacts_by_ids(s.token, ['3', '1', '4'], s.user_uuid)
+
+        assert_that(contacts, contains(has_entries(id='3'), has_entries(id='1')))
+        self.service._request.assert_not_called()
+
+
+class TestGoogleServicePagination(unittest.TestCase):
+
+    def setUp(self):
+        self.service = services.GoogleService({'http': {'stream': False}})
+        self.service._get = Mock(side_effect=[
+            {
+                'link': [{'rel': 'next', 'href': s.next_page}],
+                'entry': [{'title': {'$t': 'Mario Bros'}}, {'title': {'$t': 'Luigi Bros'}}],
+            },
+            {
+                'entry': [{'title': {'$t': 'Peach'}}],
+            },
+        ])
+
+    def test_all_pages_are_fetched(self):
+        contacts, total = self.service.get_contacts(s.token)
+
+        assert_that(total, equal_to(3))
+        self.service._get.assert_any_call(s.token, **{'start-index': 1})
+        self.service._get.assert_any_call(s.token, **{'start-index': 3})
+
+    def test_pages_are_not_fetched_after_the_limit(self):
+        contacts = list(self.service.get_contacts_with_term(s.token, 'bros', limit=2))
+
+        assert_that(contacts, contains(has_entries(name='Mario Bros'), has_entries(name='Luigi Bros')))
+        self.service._get.assert_called_once_with(s.token, q='bros', **{'start-index': 1})
+
+    def test_failed_page_stops_the_iteration(self):
+        self.service._get.side_effect = [{'link': [{'rel': 'next'}], 'entry': [{}]}, None]
+
+        contacts, total = self.service.get_contacts(s.token)
+
+        assert_that(total, equal_to(1))
+
+
+@unittest.skipIf(services.ijson is None, 'ijson is not installed')
+class TestGoogleServiceStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.service = services.GoogleService()
+        self.service.session = Mock()
+        self.read_chunks = []
+
+    def response(self, feed, chunk_size=16):
+        body = json.dumps({'feed': feed}).encode()
+        chunks = self.chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+
+        def iter_content(_):
+            for chunk in chunks:
+                self.read_chunks.append(chunk)
+                yield chunk
+
+        response = MagicMock(status_code=200)
+        response.__enter__.return_value = response
+        response.iter_content.side_effect = iter_content
+        return response
+
+    def test_entries_are_formatted_as_they_are_received(self):
+        self.service.session.get.return_value = self.response({
+            'entry': [{'title': {'$t': 'Mario'}}, {'title': {'$t': 'Luigi'}}],
+        })
+
+        contacts = self.service.get_contacts_with_term(s.token, 'bros')
+
+        assert_that(next(contacts), has_entries(name='Mario'))
+        assert_that(len(self.read_chunks), less_than(len(self.chunks)))
+        assert_that(list(contacts), contains(has_entries(name='Luigi')))
+
+    def test_all_pages_are_streamed(self):
+        self.service.session.get.side_effect = [
+            self.response({
+                'link': [{'rel': 'next', 'href': 'next-page'}],
+                'entry': [{'title': {'$t': 'Mario'}}, {'title': {'$t': 'Luigi'}}],
+            }),
+            self.response({'entry': [{'title': {'$t': 'Peach'}}]}),
+        ]
+
+        contacts = list(self.service.get_contacts_with_term(s.token, None))
+
+        assert_that(contacts, contains(
+            has_entries(name='Mario'),
+            has_entries(name='Luigi'),
+            has_entries(name='Peach'),
+        ))
+        second_call_params = self.service.session.get.call_args_list[1][1]['params']
+        assert_that(second_call_params, has_entries(**{'start-index': 3}))
+
+    def test_truncated_feed_stops_the_iteration(self):
+        response = self.response({'entry': [{'title': {'$t': 'Mario'}}, {'title': {'$t': 'Luigi'}}]})
+        response.iter_content.side_effect = lambda _: iter([b'{"feed": {"entry": [{"title": {"$t": "Mario"}}, {"ti'])
+        self.service.session.get.return_value = response
+
+        contacts = list(self.service.get_contacts_with_term(s.token, None))
+
+        assert_that(contacts, contains(has_entries(name='Mario')))
+
+
+class TestPhoneNumberNormalizer(unittest.TestCase):
+
+    def setUp(self):
+        self.normalizer = services.PhoneNumberNormalizer(country_code='33')
+
+    def test_canonical(self):
+        assert_that(self.normalizer.canonical('+33 1 23 45 67 89'), equal_to('+33123456789'))
+        assert_that(self.normalizer.canonical('0033 1 23 45 67 89'), equal_to('+33123456789'))
+        assert_that(self.normalizer.canonical('01.23.45.67.89'), equal_to('+33123456789'))
+        assert_that(self.normalizer.canonical('1234'), equal_to('1234'))
+        assert_that(self.normalizer.canonical('mario'), equal_to('mario'))
+        assert_that(self.normalizer.canonical('mario bros'), equal_to('mario bros'))
+        assert_that(self.normalizer.canonical('john.doe@x.com'), equal_to('john.doe@x.com'))
+
+    def test_canonical_without_country_code(self):
+        normalizer = services.PhoneNumberNormalizer()
+
+        assert_that(normalizer.canonical('0033 1 23 45 67 89'), equal_to('+33123456789'))
+        assert_that(normalizer.canonical('01 23 45 67 89'), equal_to('0123456789'))
+
+    def test_variants(self):
+        assert_that(self.normalizer.variants('01 23 45 67 89'), contains(
+            '+33123456789',
+            '0033123456789',
+            '0123456789',
+        ))
+        assert_that(self.normalizer.variants('+1 555 123 4567'), contains(
+            '+15551234567',
+            '0015551234567',
+        ))
+
+
+class TestGoogleServiceListPushdown(unittest.TestCase):
+
+    def setUp(self):
+        services.contact_cache.clear()
+        self.service = services.GoogleService({'uuid': s.source_uuid, 'http': {'stream': False}})
+        self.service._get = Mock(return_value={
+            'openSearch$totalResults': {'$t': '42'},
+            'entry': [{'title': {'$t': 'Mario'}}, {'title': {'$t': 'Luigi'}}],
+        })
+
+    def tearDown(self):
+        services.contact_cache.clear()
+
+    def test_sorted_page_from_stream(self):
+        contacts, total = self.service.get_contacts(s.token, order='name', limit=1, offset=1)
+
+        assert_that(total, equal_to(2))
+        assert_that(contacts, contains(has_entries(name='Mario')))
+
+    def test_sorted_page_from_cache(self):
+        book = services.ContactBook([{'id': '1', 'name': 'b'}, {'id': '2', 'name': 'c'}, {'id': '3', 'name': 'a'}])
+        services.contact_cache.set((s.source_uuid, s.user_uuid), book)
+
+        contacts, total = self.service.get_contacts(
+            s.token, s.user_uuid, order='name', direction='desc', limit=2,
+        )
+
+        assert_that(total, equal_to(3))
+        assert_that(contacts, contains(has_entries(name='c'), has_entries(name='b')))
+        assert_that(book.sorted_contacts('name', True), contains(
+            has_entries(name='c'), has_entries(name='b'), has_entries(name='a'),
+        ))
+
+    def test_sort_keeps_only_the_requested_page(self):
+        contacts = [{'name': name} for name in 'ecadb']
+
+        result = self.service._sort(contacts, order='name', limit=2, offset=1)
+
+        assert_that(result, contains(*[has_entries(name=name) for name in 'abc']))
 
 
 class TestGoogleContactFormatter(unittest.TestCase):
@@ -81,6 +961,32 @@ class TestGoogleContactFormatter(unittest.TestCase):
             ),
         ))
 
+    def test_normalized_numbers(self):
+        normalizer = services.PhoneNumberNormalizer(
+            country_code='1',
+            international_prefix='011',
+            trunk_prefix='1',
+        )
+        formatter = services.ContactFormatter(normalizer)
+        google_contact = {
+            'gd$phoneNumber': [
+                {
+                    'rel': 'http://schemas.google.com/g/2005#mobile',
+                    '$t': '+1 555-123-4567',
+                },
+                {
+                    'label': 'custom',
+                    '$t': '011 1 (555) 123-4567',
+                },
+            ],
+        }
+
+        formatted_contact = formatter.format(google_contact)
+
+        assert_that(formatted_contact, has_entries(
+            normalized_numbers=contains('+15551234567', '01115551234567', '15551234567'),
+        ))
+
     def test_multiple_emails(self):
         google_contact = {
             'gd$email': [
@@ -103,3 +1009,22 @@ class TestGoogleContactFormatter(unittest.TestCase):
                 'other@example.com',
             ),
         ))
+
+    def test_formatted_contact_is_a_mapping(self):
+        google_contact = {
+            'id': {'$t': 'http://www.google.com/m8/feeds/contacts/me%40example.com/base/42'},
+            'title': {'$t': 'Joe Blow'},
+        }
+
+        formatted_contact = self.formatter.format(google_contact)
+
+        assert_that(dict(formatted_contact), equal_to({
+            'id': '42',
+            'name': 'Joe Blow',
+            'numbers_by_label': {},
+            'numbers': [],
+            'normalized_numbers': [],
+            'emails': [],
+        }))
+        assert_that(formatted_contact.get('unknown'), none())
+        assert_that(formatted_contact, not_(has_property('__dict__')))
@@ -0,0 +1,174 @@
+# Copyright 2019 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from hamcrest import (
+    assert_that,
+    contains,
+    equal_to,
+    greater_than,
+    has_entries,
+    none,
+)
+from mock import Mock, patch, sentinel as s
+
+from .. import services
+from .. import store
+from ..store import ContactStore
+
+
+class TestContactStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'google.sqlite')
+        self.store = ContactStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_save_and_load(self):
+        self.store.save(('source', 'user'), 42.0, {'contacts': []})
+        self.store.save(('source', 'user', ('id', 'title')), 43.0, {'contacts': [1]})
+
+        assert_that(self.store.load(('source', 'user')), equal_to((42.0, {'contacts': []})))
+        assert_that(self.store.load(('source', 'user', ('id', 'title'))), equal_to((43.0, {'contacts': [1]})))
+        assert_that(self.store.load(('source', 'other')), none())
+
+    def test_stored_books_survive_a_restart(self):
+        self.store.save(('source', 'user'), 42.0, {'contacts': []})
+        self.store.close()
+
+        self.store = ContactStore(self.path)
+
+        assert_that(self.store.load(('source', 'user')), equal_to((42.0, {'contacts': []})))
+
+    def test_touch(self):
+        self.store.save(('source', 'user'), 42.0, {'contacts': []})
+
+        assert_that(self.store.touch(('source', 'user'), 43.0), equal_to(True))
+        assert_that(self.store.touch(('source', 'other'), 43.0), equal_to(False))
+
+        assert_that(self.store.load(('source', 'user')), equal_to((43.0, {'contacts': []})))
+        assert_that(self.store.load(('source', 'other')), none())
+
+    def test_delete_user(self):
+        self.store.save(('source', 'user'), 42.0, {})
+        self.store.save(('source', 'other'), 42.0, {})
+
+        self.store.delete_user('user')
+
+        assert_that(self.store.load(('source', 'user')), none())
+        assert_that(self.store.load(('source', 'other')), equal_to((42.0, {})))
+
+    def test_delete_user_from_a_store_not_opened_yet(self):
+        self.store.save(('source', 'user'), 42.0, {})
+        self.store.close()
+
+        try:
+            store.delete_user('user', self.path)
+            opened = store._stores.pop(self.path)
+            opened.close()
+        finally:
+            self.store = ContactStore(self.path)
+
+        assert_that(self.store.load(('source', 'user')), none())
+
+    def test_delete_user_without_store(self):
+        store.delete_user('user', os.path.join(self.directory, 'missing.sqlite'))
+
+        assert_that(os.path.exists(os.path.join(self.directory, 'missing.sqlite')), equal_to(False))
+
+    def test_corrupted_store_is_started_over(self):
+        self.store.close()
+        with open(self.path, 'wb') as f:
+            f.write(b'not a sqlite database' * 100)
+
+        self.store = ContactStore(self.path)
+
+        assert_that(self.store.load(('source', 'user')), none())
+        assert_that(os.path.exists(self.path + '.corrupted'), equal_to(True))
+
+
+class TestGoogleServiceStore(unittest.TestCase):
+
+    def setUp(self):
+        services.contact_cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.store = ContactStore(os.path.join(self.directory, 'google.sqlite'))
+        config = {'uuid': 'source-uuid', 'cache': {'persistent': True}, 'http': {'stream': False}}
+        with patch('wazo_google.dird.services.store.get_store', return_value=self.store):
+            self.service = services.GoogleService(config)
+        self.service._get = Mock(return_value={
+            'updated': {'$t': '2019-05-01T12:00:00.000Z'},
+            'link': [],
+            'entry': [{
+                'id': {'$t': 'http://www.google.com/m8/feeds/contacts/me/base/1'},
+                'title': {'$t': 'Mario'},
+                'gd$phoneNumber': [{'rel': 'http://schemas.google.com/g/2005#mobile', '$t': '555-1234'}],
+            }],
+        })
+
+    def tearDown(self):
+        services.contact_cache.clear()
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_contacts_loaded_from_the_store_after_a_restart(self):
+        self.service.get_contacts(s.token, 'user-uuid')
+        services.contact_cache.clear()
+        self.service._get.reset_mock()
+
+        contacts, _ = self.service.get_contacts(s.token, 'user-uuid')
+
+        self.service._get.assert_not_called()
+        assert_that(contacts, contains(has_entries(
+            id='1',
+            name='Mario',
+            numbers_by_label={'mobile': '5551234'},
+        )))
+        book = services.contact_cache.get(('source-uuid', 'user-uuid'))
+        assert_that(book.updated, equal_to('2019-05-01T12:00:00.000Z'))
+        assert_that(book.pages[0].contacts, contains(has_entries(id='1')))
+
+    def test_not_modified_contacts_are_not_stored_again(self):
+        self.service.get_contacts(s.token, 'user-uuid')
+        book = services.contact_cache.get(('source-uuid', 'user-uuid'))
+        book.synced_at -= 61
+        saved_at, _ = self.store.load(('source-uuid', 'user-uuid'))
+        self.service._get.return_value = services.NOT_MODIFIED
+
+        with patch.object(self.store, 'save') as save:
+            self.service.get_contacts(s.token, 'user-uuid')
+
+        save.assert_not_called()
+        assert_that(self.store.load(('source-uuid', 'user-uuid'))[0], greater_than(saved_at))
+        assert_that(book.is_expired(60), equal_to(False))
+
+    def test_contacts_of_a_deleted_user_are_forgotten(self):
+        self.service.get_contacts(s.token, 'user-uuid')
+
+        with patch('wazo_google.dird.services.store.delete_user', self.store.delete_user):
+            services.delete_user_books('user-uuid')
+
+        assert_that(services.contact_cache.get(('source-uuid', 'user-uuid')), none())
+        assert_that(self.store.load(('source-uuid', 'user-uuid')), none())
+
+    def test_fetch_finishing_after_the_user_deletion_is_not_kept(self):
+        fetched = self.service._get.return_value
+
+        def get(*args, **kwargs):
+            services.delete_user_books('user-uuid')
+            return fetched
+
+        self.service._get.side_effect = get
+        with patch('wazo_google.dird.services.store.delete_user', self.store.delete_user):
+            self.service.get_contacts(s.token, 'user-uuid')
+
+        assert_that(services.contact_cache.get(('source-uuid', 'user-uuid')), none())
+        assert_that(self.store.load(('source-uuid', 'user-uuid')), none())
@@ -5,7 +5,10 @@ import logging
 
 from wazo_dird.helpers import BaseBackendView
 
-from .http import GoogleItem, GoogleList, GoogleContactList
+from . import services
+from .bus import BusConsumer
+from .http import GoogleItem, GoogleList, GoogleContactList, GoogleMetrics, GoogleWarmup
+from .prewarm import Prewarmer
 
 
 logger = logging.getLogger(__name__)
@@ -17,6 +20,12 @@ class GoogleView(BaseBackendView):
     item_resource = GoogleItem
     list_resource = GoogleList
     contact_list_resource = GoogleContactList
+    metrics_resource = GoogleMetrics
+    warmup_resource = GoogleWarmup
+
+    def __init__(self):
+        self.prewarmer = None
+        self.bus_consumer = None
 
     def load(self, dependencies):
         super().load(dependencies)
@@ -31,3 +40,61 @@ class GoogleView(BaseBackendView):
             "/backends/google/sources/<source_uuid>/contacts",
             resource_class_args=args,
         )
+        api.add_resource(
+            self.metrics_resource,
+            "/backends/google/metrics",
+        )
+
+        prewarm_config = config.get('google', {}).get('prewarm', {})
+        self.prewarmer = Prewarmer(auth_config, source_service, **prewarm_config)
+        api.add_resource(
+            self.warmup_resource,
+            "/backends/google/warmup",
+            resource_class_args=(self.prewarmer,),
+        )
+
+        bus_config = config.get('bus')
+        if bus_config:
+            self.bus_consumer = BusConsumer(**bus_config)
+            self.bus_consumer.subscribe(
+                'auth_user_external_auth_added',
+                'auth.users.*.external.google.created',
+                self._on_external_auth_added,
+            )
+            self.bus_consumer.subscribe(
+                'auth_user_external_auth_deleted',
+                'auth.users.*.external.google.deleted',
+                self._on_external_auth_event,
+            )
+            self.bus_consumer.subscribe(
+                'auth_session_created',
+                'auth.sessions.*.created',
+                self._on_session_created,
+            )
+            self.bus_consumer.start()
+
+    def unload(self):
+        if self.bus_consumer:
+            self.bus_consumer.stop()
+        if self.prewarmer:
+            self.prewarmer.stop()
+
+    def _on_external_auth_event(self, data):
+        if data.get('external_auth_name') != 'google':
+            return
+
+        logger.debug('Google account of user %s changed', data.get('user_uuid'))
+        services.token_cache.invalidate_user(data.get('user_uuid'))
+        # The contacts of the previous account must not be served or synchronized with the new one
+        services.delete_user_books(data.get('user_uuid'))
+
+    def _on_external_auth_added(self, data):
+        self._on_external_auth_event(data)
+        if data.get('external_auth_name') == 'google':
+            self.prewarmer.warm_user(data.get('user_uuid'))
+
+    def _on_session_created(self, data):
+        user_uuid = data.get('user_uuid')
+        if user_uuid:
+            # The contacts are loaded before the first call reaches the user
+            self.prewarmer.warm_user(user_uuid, data.get('tenant_uuid'))